@@ -0,0 +1,336 @@
+import argparse
+import contextlib
+import ctypes
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+'''
+end-to-end benchmarks of the voxel pipeline's hot paths, on generated data with fixed seeds:
+    erosion     two_tone / three_tone on random grids (both backends), 32^3 to 256^3
+    sendit      encode() and places() against a local fake GDMC /blocks server
+    schematic   schematic_to_block.load_schematic on a generated .schematic
+    litematic   litematic_to_block.load_litematic on a generated .litematic
+    auto_down   render_and_save on data/example_church.json (needs grabcraft-to-schema's lib/)
+
+every case reports its best time over --repeat runs, throughput and memory, both measured in separate
+runs so they don't skew the timings: rss_mb is how far the resident set peaked above its size at the
+start of one call (it includes torch's allocations), python_mb the
+peak of Python/NumPy allocations (tracemalloc) and, for torch cases, torch_mb the rest of the growth.
+suites whose dependencies are missing are skipped. results are saved as JSON; pass --baseline to
+compare against an earlier run. memory is measured on Linux only.
+
+python bench_pipeline.py --out results.json
+python bench_pipeline.py --only erosion sendit --baseline results.json
+'''
+
+ROOT = Path(__file__).resolve().parent.parent
+GRABCRAFT = ROOT / "scraper" / "grabcraft-to-schema"
+for path in (ROOT / "mcvis", ROOT / "utils", GRABCRAFT):
+    sys.path.insert(0, str(path))
+
+SUITES = ('erosion', 'sendit', 'schematic', 'litematic', 'auto_down')
+SEED = 0
+
+
+def proc_status_mb(key):
+    '''a memory line of /proc/self/status, e.g. VmRSS (resident set now) or VmHWM (its high-water mark)'''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) / 1e3
+
+
+def rss_growth(fn):
+    '''
+    MB the resident set peaked above its starting size during one call of fn, None where that
+    can't be measured (not Linux/glibc). writing 5 to clear_refs resets the high-water mark to the current size.
+    '''
+    try:
+        # hand memory freed by earlier runs back to the OS first, or fn would reuse it without growing the RSS
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (OSError, AttributeError):
+        return None
+    start = proc_status_mb('VmRSS')
+    fn()
+    return proc_status_mb('VmHWM') - start
+
+
+def measure(fn, repeat):
+    '''(best seconds over repeat calls, RSS growth in MB during one call, Python/NumPy peak MB during another)'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    rss = rss_growth(fn)
+    tracemalloc.start()
+    fn()
+    python = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return best, rss, python
+
+
+def record(results, name, fn, repeat, units, torch=False):
+    '''
+    times fn and stores {seconds, rss_mb, python_mb, (torch_mb,) <unit>_per_s...} under results[name]
+    - units: {unit: count processed per call}, e.g. {'voxels': 32 ** 3}
+    - torch: fn works on torch tensors, whose CPU allocations tracemalloc can't see; they are
+    recorded as torch_mb, the RSS growth beyond the Python/NumPy peak
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, rss, python = measure(fn, repeat)
+    result = {'seconds': seconds, 'rss_mb': rss, 'python_mb': python}
+    if torch and rss is not None:
+        result['torch_mb'] = max(rss - python, 0.0)
+    for unit, count in units.items():
+        result[f'{unit}_per_s'] = count / seconds
+    results[name] = result
+    rates = ', '.join(f'{result[f"{unit}_per_s"] / 1e6:.2f} M {unit}/s' for unit in units)
+    rss = '-' if rss is None else f'{rss:.1f}'
+    print(f'{name:<40}{seconds * 1000:>10.1f} ms {rss:>9} MB rss {python:>8.1f} MB py  {rates}')
+
+
+def skipped(suite, e):
+    print(f'{suite:<40}skipped ({e})')
+
+
+## SUITES ##
+
+def bench_erosion(results, sizes, repeat):
+    try:
+        import torch
+        from erosion import BACKENDS, two_tone, three_tone
+    except ImportError as e:
+        return skipped('erosion', e)
+
+    for size in sizes:
+        gen = torch.Generator().manual_seed(SEED)
+        house = (torch.rand(1, 1, size, size, size, generator=gen) < 0.5).float()
+        for tone in (two_tone, three_tone):
+            for backend in BACKENDS:
+                record(results, f'erosion.{tone.__name__}.{backend}.{size}',
+                       lambda: tone(house, backend), repeat, {'voxels': size ** 3}, torch=backend == 'torch')
+
+
+class FakeGDMC(BaseHTTPRequestHandler):
+    '''accepts PUT /blocks and POST /commands like the GDMC HTTP interface, without a game behind it'''
+    def do_PUT(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.reply(len(body))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.reply(len(body.splitlines()))
+
+    def reply(self, n):
+        out = json.dumps([{'status': 1}] * n).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_sendit(results, size, repeat):
+    try:
+        import sendit
+    except ImportError as e:
+        return skipped('sendit', e)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGDMC)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    sendit.URL, sendit.COMMAND_URL = f'{base}/blocks', f'{base}/commands'
+
+    rng = np.random.default_rng(SEED)
+    labels = rng.integers(0, 4, size=(size, size, size, 1))
+    labels[rng.random(labels.shape) < 0.7] = 0
+    solid = int((labels != 0).sum())
+    palette = sendit.DEFAULT_PALETTE
+    try:
+        record(results, f'sendit.encode.{size}',
+               lambda: sendit.encode(labels, clear_space=False, palette=palette, seed=SEED),
+               repeat, {'voxels': size ** 3, 'blocks': solid})
+        record(results, f'sendit.places.{size}',
+               lambda: sendit.places(labels, clear_space=False, palette=palette, seed=SEED),
+               repeat, {'blocks': solid})
+        record(results, f'sendit.places_fill.{size}',
+               lambda: sendit.places(labels, clear_space=False, palette=palette, seed=SEED, fill=True),
+               repeat, {'blocks': solid})
+    finally:
+        server.shutdown()
+
+
+def write_schematic(path, size):
+    from nbt import nbt
+
+    rng = np.random.default_rng(SEED)
+    schematic = nbt.NBTFile()
+    schematic.name = 'Schematic'
+    for name in ('Width', 'Height', 'Length'):
+        schematic.tags.append(nbt.TAG_Short(name=name, value=size))
+    for name, high in (('Blocks', 200), ('Data', 16)):
+        tag = nbt.TAG_Byte_Array(name=name)
+        tag.value = bytearray(rng.integers(0, high, size ** 3, dtype=np.uint8).tobytes())
+        schematic.tags.append(tag)
+    schematic.write_file(path)
+
+
+def bench_schematic(results, size, repeat, tmp):
+    try:
+        from schematic_to_block import load_schematic
+    except ImportError as e:
+        return skipped('schematic', e)
+
+    path = os.path.join(tmp, 'bench.schematic')
+    write_schematic(path, size)
+    record(results, f'schematic.load_schematic.{size}', lambda: load_schematic(path), repeat, {'voxels': size ** 3})
+
+
+def write_litematic(path, size, palette_size=40, regions=2):
+    '''regions of size^3 random blocks, packed the way Litematica does (see litematic_to_block.unpack_longs)'''
+    import nbtlib
+    from litematic_to_block import needed_bits
+
+    rng = np.random.default_rng(SEED)
+    nbits = needed_bits(palette_size)
+    compound = {}
+    for r in range(regions):
+        values = rng.integers(0, palette_size, size ** 3, dtype=np.uint64)
+        bits = ((values[:, None] >> np.arange(nbits, dtype=np.uint64)) & np.uint64(1)).astype(np.uint8).ravel()
+        bits = np.concatenate((bits, np.zeros(-bits.size % 64, dtype=np.uint8)))
+        longs = np.packbits(bits, bitorder='little').view('<i8')
+        compound[f'region{r}'] = nbtlib.Compound({
+            'Position': nbtlib.Compound({axis: nbtlib.Int(r * size if axis == 'x' else 0) for axis in 'xyz'}),
+            'Size': nbtlib.Compound({axis: nbtlib.Int(size) for axis in 'xyz'}),
+            'BlockStatePalette': nbtlib.List[nbtlib.Compound](
+                [nbtlib.Compound({'Name': nbtlib.String('minecraft:air')})] +
+                [nbtlib.Compound({'Name': nbtlib.String(f'minecraft:block_{i}')}) for i in range(1, palette_size)]
+            ),
+            'BlockStates': nbtlib.LongArray(longs),
+        })
+    nbtlib.File({'Regions': nbtlib.Compound(compound)}, gzipped=True).save(path)
+    return regions * size ** 3
+
+
+def bench_litematic(results, size, repeat, tmp):
+    try:
+        from litematic_to_block import load_litematic  # needs nbtlib, which write_litematic uses too
+    except ImportError as e:
+        return skipped('litematic', e)
+
+    path = os.path.join(tmp, 'bench.litematic')
+    voxels = write_litematic(path, size)
+    record(results, f'litematic.load_litematic.{size}', lambda: load_litematic(path), repeat, {'voxels': voxels})
+
+
+def bench_auto_down(results, repeat, tmp):
+    cwd = os.getcwd()
+    os.chdir(GRABCRAFT)  # auto_down loads data/blockmap.csv relative to its directory
+    try:
+        import auto_down
+    except ImportError as e:
+        return skipped('auto_down', e)
+    finally:
+        os.chdir(cwd)
+
+    with open(GRABCRAFT / 'data' / 'example_church.json') as f:
+        obj = f.read()
+    width, height, length = 23, 31, 31
+    # the fields render_object_to_png_slice reads from a RenderObject
+    schem = SimpleNamespace(obj=obj, name='bench church', dims=[width, height, length], tags=[])
+    count = [0]
+
+    def render():
+        # a fresh directory per run, render_and_save skips populated ones
+        count[0] += 1
+        auto_down.render_and_save(schem, f'bench{count[0]}', os.path.join(tmp, f'auto_down{count[0]}'))
+
+    record(results, 'auto_down.render_and_save', render, repeat, {'voxels': width * height * length})
+
+
+## BASELINE ##
+
+def compare(results, baseline, threshold):
+    '''prints the time ratio of every case also in the baseline; returns the cases slower by more than threshold'''
+    regressions = []
+    print(f'\n{"case":<40}{"baseline ms":>12}{"now ms":>10}{"ratio":>8}')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, now = baseline[name]['seconds'], result['seconds']
+        ratio = now / before
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<40}{before * 1000:>12.1f}{now * 1000:>10.1f}{ratio:>8.2f}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the voxel pipeline')
+    parser.add_argument('--only', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 64, 128, 256], help='erosion grid sizes')
+    parser.add_argument('--sendit-size', type=int, default=64)
+    parser.add_argument('--file-size', type=int, default=128, help='side length of the generated schematic/litematic')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default='bench_results.json', help='where to save the results')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown counted as a regression (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if 'erosion' in args.only:
+            bench_erosion(results, args.sizes, args.repeat)
+        if 'sendit' in args.only:
+            bench_sendit(results, args.sendit_size, args.repeat)
+        if 'schematic' in args.only:
+            bench_schematic(results, args.file_size, args.repeat, tmp)
+        if 'litematic' in args.only:
+            bench_litematic(results, args.file_size, args.repeat, tmp)
+        if 'auto_down' in args.only:
+            bench_auto_down(results, args.repeat, tmp)
+
+    meta = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'seed': SEED,
+        'repeat': args.repeat,
+    }
+    with open(args.out, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print(f'saved {len(results)} results to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
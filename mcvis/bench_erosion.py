@@ -0,0 +1,87 @@
+import argparse
+import time
+import torch
+from erosion import BACKENDS, DETECTORS, orient, selective_keep, merge_arrays, two_tone, three_tone, two_tone_batch, three_tone_batch
+
+'''
+benchmark the fused kernel bank in erosion.py (both backends) against the per-kernel
+implementation it replaced, and check that they all give bit-identical output.
+
+python bench_erosion.py --n 64 --size 32 --chunk 16
+'''
+
+def legacy_detect(data, name):
+    '''the old detectors: kernels rebuilt and convolved one at a time on every call'''
+    include, exclude, turns = DETECTORS[name]
+    found = []
+    for i in range(turns):
+        new_k = [orient(k, i).to(data.device) for k in include]
+        new_kx = [orient(k, i).to(data.device) for k in exclude]
+        found.append(selective_keep(data, new_k, new_kx))
+    return merge_arrays(found)
+
+def legacy_two_tone(data):
+    return merge_arrays([data, legacy_detect(data, 'walls') * 2])
+
+def legacy_three_tone(data):
+    pillar_merged = merge_arrays([legacy_detect(data, 'pillars'), legacy_detect(data, 'pillars2')])
+    wall_blocks = legacy_detect(data, 'walls')
+    return merge_arrays([data, wall_blocks * 2, pillar_merged * 3])
+
+def random_houses(n, size, density=0.5, seed=0):
+    '''n thresholded random grids of shape (1, size, size, size)'''
+    gen = torch.Generator().manual_seed(seed)
+    return (torch.rand(n, 1, size, size, size, generator=gen) < density).float()
+
+def bench(fn, houses, repeat=3, **kwargs):
+    '''best wall time over `repeat` runs of fn on every house, one at a time'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for house in houses:
+            fn(house, **kwargs)
+        if houses.is_cuda:
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_batch(fn, houses, chunk_size, repeat=3, **kwargs):
+    '''best wall time over `repeat` runs of fn on the whole stack of houses'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(houses, chunk_size, **kwargs)
+        if houses.is_cuda:
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark erosion.two_tone/three_tone')
+    parser.add_argument('--n', type=int, default=64, help='number of houses')
+    parser.add_argument('--size', type=int, default=32, help='grid side length')
+    parser.add_argument('--chunk', type=int, default=16, help='chunk size for the batched entry points')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    houses = random_houses(args.n, args.size).to(args.device)
+    for name, legacy, fused, batched in [
+        ('two_tone', legacy_two_tone, two_tone, two_tone_batch),
+        ('three_tone', legacy_three_tone, three_tone, three_tone_batch),
+    ]:
+        expected = [legacy(house) for house in houses]
+        t_legacy = bench(legacy, houses, args.repeat)
+        print(f'{name}: {args.n} x {args.size}^3, legacy {t_legacy * 1000:.1f} ms')
+        for backend in BACKENDS:
+            batch_out = batched(houses, args.chunk, backend=backend)
+            for house, toned, want in zip(houses, batch_out, expected):
+                assert torch.equal(want, fused(house, backend=backend)), f'{name} ({backend}) output differs'
+                assert torch.equal(want, toned), f'{name}_batch ({backend}) output differs'
+            t_fused = bench(fused, houses, args.repeat, backend=backend)
+            t_batch = bench_batch(batched, houses, args.chunk, args.repeat, backend=backend)
+            print(f'  {backend}: fused {t_fused * 1000:.1f} ms, speedup {t_legacy / t_fused:.2f}x, '
+                  f'batched (chunk {args.chunk}) {t_batch * 1000:.1f} ms, speedup {t_legacy / t_batch:.2f}x')
+
+if __name__ == '__main__':
+    main()
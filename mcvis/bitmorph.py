@@ -0,0 +1,102 @@
+import numpy as np
+
+'''
+binary hit-or-miss on voxel grids packed into uint64 bitsets along the last (z) axis,
+for CPU-only boxes: a 3x3x3 kernel is tested with array shifts in x, y, bit shifts
+in z and bitwise AND/ANDNOT instead of a float32 convolution.
+'''
+
+ONE = np.uint64(1)
+TOP = np.uint64(63)
+
+def pack(data):
+    '''
+    data: bool np array of shape (..., D, H, W)
+    returns a uint64 np array of shape (..., D, H, ceil(W / 64)),
+    where bit b of word w is voxel z = w * 64 + b
+    '''
+    width = data.shape[-1]
+    words = -(-width // 64)
+    bits = np.zeros(data.shape[:-1] + (words * 64,), dtype=bool)
+    bits[..., :width] = data
+    return np.packbits(bits, axis=-1, bitorder='little').view('<u8')
+
+def unpack(packed, width):
+    '''inverse of pack: returns a bool np array of shape (..., D, H, width)'''
+    packed = np.ascontiguousarray(packed, dtype='<u8')
+    return np.unpackbits(packed.view(np.uint8), axis=-1, count=width, bitorder='little').astype(bool)
+
+def _span(d, n):
+    '''(destination, source) slices that move index i + d to i, dropping what falls off the edge'''
+    if d >= 0:
+        return slice(0, n - d), slice(d, n)
+    return slice(-d, n), slice(0, n + d)
+
+def shift(packed, dx, dy, dz):
+    '''
+    packed: output of pack()
+    returns the packed grid whose voxel (x, y, z) is voxel (x + dx, y + dy, z + dz)
+    of the input, with zeros past the edges (the same as conv3d's padding=1).
+    dx, dy, dz are each -1, 0 or 1.
+    '''
+    dst_x, src_x = _span(dx, packed.shape[-3])
+    dst_y, src_y = _span(dy, packed.shape[-2])
+    out = np.zeros_like(packed)
+    out[..., dst_x, dst_y, :] = packed[..., src_x, src_y, :]
+
+    if dz == 1:
+        shifted = out >> ONE
+        shifted[..., :-1] |= out[..., 1:] << TOP
+        return shifted
+    if dz == -1:
+        shifted = out << ONE
+        shifted[..., 1:] |= out[..., :-1] >> TOP
+        return shifted
+    return out
+
+class BitKernelBank:
+    '''
+    the bitset counterpart of erosion.KernelBank: the same kernels and detector rules,
+    matched on packed grids.
+    '''
+    def __init__(self, kernels, rules):
+        '''
+        kernels: np array of shape (K, 3, 3, 3), one oriented kernel per channel
+        rules: detector name -> [(include channels, exclude channels)]
+        '''
+        # offsets of each kernel's 1s from its center
+        self.offsets = [[tuple(o) for o in np.argwhere(k != 0) - 1] for k in kernels]
+        self.rules = rules
+
+    def match(self, packed):
+        '''
+        packed: output of pack(), of shape (..., 1, D, H, words)
+        returns the packed hits of shape (..., K, D, H, words), with bits set where the entire kernel fits
+        '''
+        shifted = {}
+        hits = []
+        for offsets in self.offsets:
+            hit = None
+            for offset in offsets:
+                if offset not in shifted:
+                    shifted[offset] = shift(packed, *offset)
+                if hit is None:
+                    hit = shifted[offset].copy()
+                else:
+                    hit &= shifted[offset]
+            hits.append(hit)
+        return np.concatenate(hits, axis=-4)
+
+    def detect(self, hits, name):
+        '''
+        hits: output of match()
+        returns the packed mask of blocks highlighted by the detector's include kernels
+        but not by its exclude kernels, in any rotation
+        '''
+        mask = None
+        for include, exclude in self.rules[name]:
+            keep = np.bitwise_or.reduce(hits[..., include, :, :, :], axis=-4, keepdims=True)
+            if exclude:
+                keep &= ~np.bitwise_or.reduce(hits[..., exclude, :, :, :], axis=-4, keepdims=True)
+            mask = keep if mask is None else mask | keep
+        return mask
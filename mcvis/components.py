@@ -0,0 +1,98 @@
+import itertools
+import sys
+from pathlib import Path
+import numpy as np
+sys.path.append(str(Path(__file__).resolve().parent.parent / "utils"))  # instrument.py
+import instrument
+
+'''
+connected components of voxel grids, for cleaning up generated samples before toning and placing:
+floating specks and debris the diffusion model leaves around a house cost placement time and
+confuse the wall/pillar detectors.
+
+labelling is union-find done with whole-array ops (no per-voxel BFS): every pair of neighbouring
+solid voxels is an edge, each round hooks the larger of the two roots of every edge onto the smaller,
+then pointer jumping points every voxel straight at its root, until no edge joins two roots.
+'''
+
+# neighbours counted as connected: faces only, faces and edges, or faces, edges and corners
+CONNECTIVITY = (6, 18, 26)
+
+def offsets(connectivity=6):
+    '''one of each +/- pair of neighbour offsets (the ones whose first non-zero step is positive)'''
+    if connectivity not in CONNECTIVITY:
+        raise ValueError(f"unknown connectivity: {connectivity}, expected one of {CONNECTIVITY}")
+    found = []
+    for step in itertools.product((-1, 0, 1), repeat=3):
+        nonzero = [s for s in step if s]
+        if nonzero and nonzero[0] > 0 and len(nonzero) <= {6: 1, 18: 2, 26: 3}[connectivity]:
+            found.append(step)
+    return found
+
+def edges(index, connectivity=6):
+    '''
+    index: int array whose last 3 axes are the grid, -1 where empty and the voxel's number where solid
+    returns (a, b): the numbers of every pair of neighbouring solid voxels; leading axes are never crossed
+    '''
+    a, b = [], []
+    for step in offsets(connectivity):
+        lead = (slice(None),) * (index.ndim - 3)
+        src = lead + tuple(slice(max(0, -s), size - max(0, s)) for s, size in zip(step, index.shape[-3:]))
+        dst = lead + tuple(slice(max(0, s), size - max(0, -s)) for s, size in zip(step, index.shape[-3:]))
+        both = (index[src] >= 0) & (index[dst] >= 0)
+        a.append(index[src][both])
+        b.append(index[dst][both])
+    return np.concatenate(a), np.concatenate(b)
+
+@instrument.traced('components.label')
+def label(mask, connectivity=6):
+    '''
+    mask: bool array whose last 3 axes are the grid, e.g. one (D, H, W) house or an (N, D, H, W) stack
+    returns (labels, count): int32 labels shaped like mask, 0 where empty and 1..count for the
+    components; grids in a stack never share a component
+    '''
+    mask = np.asarray(mask, dtype=bool)
+    n = int(mask.sum())
+    index = np.full(mask.shape, -1, dtype=np.int64)
+    index[mask] = np.arange(n)
+    a, b = edges(index, connectivity)
+    del index
+
+    parent = np.arange(n)
+    while True:
+        pa, pb = parent[a], parent[b]
+        apart = pa != pb
+        if not apart.any():
+            break
+        # edges inside a component stay inside it, drop them
+        a, b, pa, pb = a[apart], b[apart], pa[apart], pb[apart]
+        np.minimum.at(parent, np.maximum(pa, pb), np.minimum(pa, pb))
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+    roots, component = np.unique(parent, return_inverse=True)
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    labels[mask] = component.ravel() + 1
+    return labels, len(roots)
+
+@instrument.traced('components.cleanup')
+def cleanup(mask, min_size=8, supported=True, connectivity=6, up_axis=-1, ground_layers=1):
+    '''
+    mask: bool array whose last 3 axes are the grid, e.g. the thresholded (N, D, H, W) samples
+    drops every component smaller than min_size voxels and, if supported, every component without
+    a voxel in the bottom ground_layers layers along up_axis (the grids' z, minecraft's y, by default)
+    returns the kept voxels as a bool array shaped like mask
+    '''
+    labels, count = label(mask, connectivity)
+    keep = np.bincount(labels.ravel(), minlength=count + 1) >= min_size
+    if supported:
+        ground = np.take(labels, np.arange(ground_layers), axis=up_axis)
+        grounded = np.zeros(count + 1, dtype=bool)
+        grounded[ground.ravel()] = True
+        keep &= grounded
+    keep[0] = False
+    instrument.count('components.removed', count - int(keep.sum()))
+    return keep[labels]
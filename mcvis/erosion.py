@@ -1,12 +1,22 @@
+import functools
+import itertools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
 import torch
 import torch.nn.functional as F
+import bitmorph
+sys.path.append(str(Path(__file__).resolve().parent.parent / "utils"))  # instrument.py
+import instrument
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 def selective_keep(data, include_kernels=[], exclude_kernels=[]):
     '''
     include blocks that are highlighted by the include kernels
-    but not highlighted by the exclude kernels. 
+    but not highlighted by the exclude kernels.
     '''
     def erode_with_kernel(data, kernel):
         # Ensure kernel is 5D (batch, channels, D, H, W)
@@ -45,136 +55,410 @@ def merge_arrays(arrays):
 
     return merged
 
+def composite(base, layers, out=None):
+    '''
+    paint labels over base without cloning per layer
+    - base: tensor of labels under every layer, e.g. the thresholded data
+    - layers: list of (bool mask, label) pairs in priority order; later layers are drawn over earlier ones
+    - out: optional tensor shaped like base to write into (may be base itself, or a slice of a batched buffer)
+    '''
+    with instrument.span('erosion.composite'):
+        if out is None:
+            out = base.clone()
+        elif out is not base:
+            out.copy_(base)
+        for mask, label in layers:
+            out.masked_fill_(mask, label)
+        return out
+
 
 ## KERNELS ##
+'''
+kernels are written as z,x,y (where z is the row), see orient()
+'''
 
-def pillars(data):
-    '''
-    data: torch.tensor of shape (batch, channels, D, H, W)
-    '''
-    # a kernel for pillars
-    kernel1 = torch.tensor([
+# a kernel for pillars
+PILLAR_K = [
+    [[0,0,0], [0,0,0], [0,0,0]],
+    [[0,0,0],
+    [0,1,1],
+    [0,0,0]],
+    [[0,0,0], [0,0,0], [0,0,0]]
+]
+# exclude from set if the exkernel matches
+PILLAR_KX = [
+    [
         [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,0,0], 
-        [0,1,1], 
+        [[0,0,0],
+        [1,1,0],
         [0,0,0]],
         [[0,0,0], [0,0,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)  # Shape: (1, 1, 3, 3, 3)
-    # exclude from set if the exkernel matches
-    exkernel1 = torch.tensor([
+    ],
+    [
         [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,0,0], 
-        [1,1,0], 
+        [[0,1,0],
+        [0,1,1],
         [0,0,0]],
         [[0,0,0], [0,0,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)
-    exkernel2 = torch.tensor([
+    ],
+    [
+        [[0,0,0], [0,0,0], [0,0,0]],
+        [[0,0,0],
+        [0,1,1],
+        [0,1,0]],
+        [[0,0,0], [0,0,0], [0,0,0]]
+    ],
+]
+
+# alternative pillar detector
+PILLAR2_K = [
+    [[0,0,0], [0,0,0], [0,0,0]],
+    [[0,1,0],
+    [0,1,1],
+    [0,0,0]],
+    [[0,0,0], [0,0,0], [0,0,0]]
+]
+PILLAR2_KX = [
+    [
         [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,1,0], 
-        [0,1,1], 
+        [[0,0,0],
+        [1,1,0],
         [0,0,0]],
         [[0,0,0], [0,0,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)
-    exkernel3 = torch.tensor([
+    ],
+    [
         [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,0,0], 
-        [0,1,1], 
+        [[0,0,0],
+        [0,1,0],
         [0,1,0]],
         [[0,0,0], [0,0,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)
-    pillar_k = [kernel1]
-    pillar_kx = [exkernel1, exkernel2, exkernel3]
-    # Ensure kernels are on the same device as data
-    pillar_k = [k.to(device) for k in pillar_k]
-    pillar_kx = [k.to(device) for k in pillar_kx]
-
-    pillars = []
-    for i in range(4):
+    ],
+]
+
+WALL_K = [
+    [[0,0,0], [0,0,0], [0,0,0]],
+    [[0,0,0], [0,1,0], [0,0,0]],
+    [[0,0,0], [0,1,0], [0,0,0]]
+]
+
+# name: (include kernels, exclude kernels, number of quarter turns)
+# rotate because each pillar can be in 4 directions
+DETECTORS = {
+    'pillars': ([PILLAR_K], PILLAR_KX, 4),
+    'pillars2': ([PILLAR2_K], PILLAR2_KX, 4),
+    'walls': ([WALL_K], [], 1),
+}
+
+def orient(kernel, i=0):
+    '''
+    kernel: nested list of shape (3, 3, 3), written as z,x,y
+    returns the kernel rotated i quarter turns, as a (3, 3, 3) float tensor.
+
+    permute(1,2,0) because we were treating the kernels as z,x,y
+    (where z is the row), but our data is actually (x,y,z).
+    '''
+    kernel = torch.tensor(kernel).float()
+    return torch.rot90(kernel, i, [1, 2]).permute(1, 2, 0)
+
+class KernelBank:
+    '''
+    every oriented include/exclude kernel of every detector, de-duplicated and stacked
+    as the output channels of a single conv3d, so all detectors are matched in one pass.
+    '''
+    def __init__(self, detectors=DETECTORS, device=device, dtype=torch.float32):
+        kernels = []
+        channels = {}
+
+        def channel(kernel):
+            key = tuple(kernel.flatten().tolist())
+            if key not in channels:
+                channels[key] = len(kernels)
+                kernels.append(kernel)
+            return channels[key]
+
+        # detector name -> [(include channels, exclude channels)], one entry per rotation
+        rules = {}
+        for name, (include, exclude, turns) in detectors.items():
+            rules[name] = [
+                ([channel(orient(k, i)) for k in include], [channel(orient(k, i)) for k in exclude])
+                for i in range(turns)
+            ]
+        self.rules = {
+            name: [
+                (torch.tensor(inc, device=device), torch.tensor(exc, device=device) if exc else None)
+                for inc, exc in name_rules
+            ]
+            for name, name_rules in rules.items()
+        }
+
+        self.weight = torch.stack(kernels).unsqueeze(1).to(device, dtype)  # (K, 1, 3, 3, 3)
+        self.sums = self.weight.sum(dim=(1, 2, 3, 4)).view(-1, 1, 1, 1)
+
+    def match(self, data):
+        '''
+        data: torch.tensor of shape (channels, D, H, W) or (batch, channels, D, H, W)
+        returns a bool tensor with one channel per kernel, True where the entire kernel fits
         '''
-        permute(0,1,3,4,2) because we were treating the kernels as z,x,y 
-        (where z is the row), but our data is actually (x,y,z).
+        return F.conv3d(data, self.weight, padding=1) == self.sums
 
-        rotate because each pillar can be in 4 directions
+    def detect(self, hits, name):
         '''
-        new_pillar_k = [torch.rot90(k, i, [3, 4]).permute(0,1,3,4,2) for k in pillar_k]
-        new_pillar_kx = [torch.rot90(k, i, [3, 4]).permute(0,1,3,4,2) for k in pillar_kx]
-        # print(torch.rot90(pillar_kx[0], i, [3, 4]))
-        # print(torch.rot90(pillar_k[0], i, [3, 4]))
-        pillars.append(selective_keep(data, new_pillar_k, new_pillar_kx))
+        hits: output of match()
+        returns a bool mask shaped like the matched data: blocks highlighted by the
+        detector's include kernels but not by its exclude kernels, in any rotation
+        '''
+        mask = None
+        for include, exclude in self.rules[name]:
+            keep = hits.index_select(-4, include).any(dim=-4, keepdim=True)
+            if exclude is not None:
+                keep &= ~hits.index_select(-4, exclude).any(dim=-4, keepdim=True)
+            mask = keep if mask is None else mask | keep
+        return mask
+
+@functools.lru_cache(maxsize=None)
+def kernel_bank(names=tuple(DETECTORS), device=device, dtype=torch.float32):
+    '''the KernelBank for the named DETECTORS, built once per device and dtype'''
+    return KernelBank({name: DETECTORS[name] for name in names}, device, dtype)
+
+@functools.lru_cache(maxsize=None)
+def bit_kernel_bank(names=tuple(DETECTORS)):
+    '''the bitmorph.BitKernelBank with the same kernels and rules as kernel_bank(names)'''
+    bank = kernel_bank(names, torch.device("cpu"))
+    rules = {
+        name: [(inc.tolist(), [] if exc is None else exc.tolist()) for inc, exc in name_rules]
+        for name, name_rules in bank.rules.items()
+    }
+    return bitmorph.BitKernelBank(bank.weight[:, 0].numpy(), rules)
 
+BACKENDS = ('torch', 'numpy')
 
-    # Merge the results (logical OR operation to combine the '1's)
-    pillars = merge_arrays(pillars)
-    return pillars
+def detect_masks(data, names, backend='torch'):
+    '''
+    returns {name: bool mask shaped like data} for each of the named DETECTORS
+    - backend: 'torch' convolves data with the KernelBank, 'numpy' runs the same kernels as
+    shifts and bitwise AND/ANDNOT on data packed into uint64 bitsets (see bitmorph.py).
+    the numpy backend treats data as binary, which it is once thresholded.
+    '''
+    instrument.count('erosion.voxels', data.numel())
+    if backend == 'torch':
+        with instrument.span('erosion.detect', backend=backend, shape=list(data.shape)):
+            bank = kernel_bank(names, data.device, data.dtype)
+            hits = bank.match(data)
+            return {name: bank.detect(hits, name) for name in names}
+    if backend == 'numpy':
+        with instrument.span('erosion.detect', backend=backend, shape=list(data.shape)):
+            bank = bit_kernel_bank(names)
+            hits = bank.match(bitmorph.pack(data.cpu().numpy() != 0))
+            width = data.shape[-1]
+            return {
+                name: torch.from_numpy(bitmorph.unpack(bank.detect(hits, name), width)).to(data.device)
+                for name in names
+            }
+    raise ValueError(f"unknown backend: {backend}, expected one of {BACKENDS}")
 
-def pillars2(data):
+def detect(data, name, backend='torch'):
+    return detect_masks(data, (name,), backend)[name].float()
+
+def pillars(data, backend='torch'):
+    '''
+    data: torch.tensor of shape (batch, channels, D, H, W)
+    '''
+    return detect(data, 'pillars', backend)
+
+def pillars2(data, backend='torch'):
     # alternative pillar detector
-    kernel1 = torch.tensor([
-        [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,1,0], 
-        [0,1,1], 
-        [0,0,0]],
-        [[0,0,0], [0,0,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)  # Shape: (1, 1, 3, 3, 3)
-    exkernel1 = torch.tensor([
-        [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,0,0], 
-        [1,1,0], 
-        [0,0,0]],
-        [[0,0,0], [0,0,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)
-    exkernel2 = torch.tensor([
-        [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,0,0], 
-        [0,1,0], 
-        [0,1,0]],
-        [[0,0,0], [0,0,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)
+    return detect(data, 'pillars2', backend)
 
-    pillar_k = [kernel1]
-    pillar_kx = [exkernel1, exkernel2]
-    # Ensure kernels are on the same device as data
-    pillar_k = [k.to(device) for k in pillar_k]
-    pillar_kx = [k.to(device) for k in pillar_kx]
+def walls(data, backend='torch'):
+    return detect(data, 'walls', backend)
 
-    pillars2 = []
-    for i in range(4):
-        '''
-        permute(0,1,3,4,2) because we were treating the kernels as z,x,y 
-        (where z is the row), but our data is actually (x,y,z).
+def two_tone(data, backend='torch', out=None):
+    wall_blocks = detect_masks(data, ('walls',), backend)['walls']
+    return composite(data, [(wall_blocks, 2)], out)
 
-        rotate because each pillar can be in 4 directions
-        '''
-        new_pillar_k = [torch.rot90(k, i, [3, 4]).permute(0,1,3,4,2) for k in pillar_k]
-        new_pillar_kx = [torch.rot90(k, i, [3, 4]).permute(0,1,3,4,2) for k in pillar_kx]
-        # print(torch.rot90(pillar_kx[0], i, [3, 4]))
-        # print(torch.rot90(pillar_k[0], i, [3, 4]))
-        pillars2.append(selective_keep(data, new_pillar_k, new_pillar_kx))
-
-    # Merge the results (logical OR operation to combine the '1's)
-    pillars2 = merge_arrays(pillars2)
-    return pillars2
-
-def walls(data):
-    kernel1 = torch.tensor([
-        [[0,0,0], [0,0,0], [0,0,0]],
-        [[0,0,0], [0,1,0], [0,0,0]],
-        [[0,0,0], [0,1,0], [0,0,0]]
-    ]).float().unsqueeze(0).unsqueeze(0)
+def three_tone(data, backend='torch', out=None):
+    masks = detect_masks(data, tuple(DETECTORS), backend)
+    pillar_merged = masks['pillars'] | masks['pillars2']
+    wall_blocks = masks['walls']
+    return composite(data, [(wall_blocks, 2), (pillar_merged, 3)], out)
 
-    wall_k = [kernel1.permute(0,1,3,4,2).to(device)]
-    walls = selective_keep(data, wall_k)
-    return walls
+@instrument.traced('erosion.tone_batch')
+def tone_batch(tone, data, chunk_size=16, backend='torch', out=None):
+    '''
+    tone: two_tone or three_tone
+    data: torch.tensor of shape (N, 1, D, H, W), e.g. the whole thresholded samples.npy
+    returns the N toned grids in one (N, 1, D, H, W) tensor, toning chunk_size houses
+    per convolution so memory stays bounded. pass out= to reuse a buffer between calls.
+    '''
+    toned = torch.empty_like(data) if out is None else out
+    for start in range(0, data.shape[0], chunk_size):
+        tone(data[start:start + chunk_size], backend, out=toned[start:start + chunk_size])
+    return toned
 
-def two_tone(data):
-    wall_blocks = walls(data)
-    merged = merge_arrays([data, wall_blocks * 2])
-    return merged
+def two_tone_batch(data, chunk_size=16, backend='torch', out=None):
+    return tone_batch(two_tone, data, chunk_size, backend, out)
+
+def three_tone_batch(data, chunk_size=16, backend='torch', out=None):
+    return tone_batch(three_tone, data, chunk_size, backend, out)
+
+@instrument.traced('erosion.tone_sparse')
+def tone_sparse(tone, voxels, tile=16, chunk_size=64, backend='torch'):
+    '''
+    tone: two_tone or three_tone
+    voxels: sparse.SparseVoxels; every stored voxel counts as solid
+    tones only the tile^3 blocks of the grid that hold voxels, each cut out with a 1 voxel halo
+    from its neighbours (all the 3x3x3 kernels can see), chunk_size tiles per call, so time and
+    memory scale with the occupied tiles instead of the whole grid. the labels are the same as
+    tone() on the dense grid, since the detectors only ever mark solid voxels.
+    returns SparseVoxels with the same coords and the tone labels as values
+    '''
+    if len(voxels) == 0:
+        return voxels.with_values(voxels.values)
+    tiles, home = voxels.tiles(tile)
+    home = home.ravel()
+    # tile index -> row in tiles, -1 for empty tiles
+    grid_shape = np.array(voxels.shape) // tile + 1
+    lookup = np.full(grid_shape, -1, dtype=np.int64)
+    lookup[tuple(tiles.T)] = np.arange(len(tiles))
+
+    # a voxel is also in the halo of the neighbouring tile when it sits on the shared face
+    coords = voxels.coords
+    local = coords % tile
+    rows, points = [], []
+    for step in np.ndindex(3, 3, 3):
+        step = np.array(step) - 1
+        on_face = np.all((step == 0) | ((step == -1) & (local == tile - 1)) | ((step == 1) & (local == 0)), axis=1)
+        target = coords[on_face] // tile - step
+        # tiles past the low edges of the grid don't exist (and -1 would wrap around in lookup)
+        inside = np.all(target >= 0, axis=1)
+        row = np.full(len(target), -1, dtype=np.int64)
+        row[inside] = lookup[tuple(target[inside].T)]
+        found = row >= 0
+        rows.append(row[found])
+        points.append(coords[on_face][found] - target[found] * tile + 1)
+    rows, points = np.concatenate(rows), np.concatenate(points)
+
+    labels = np.empty(len(voxels), dtype=np.int64)
+    side = tile + 2
+    for start in range(0, len(tiles), chunk_size):
+        stop = min(start + chunk_size, len(tiles))
+        batch = torch.zeros((stop - start, 1, side, side, side), device=device)
+        pick = (rows >= start) & (rows < stop)
+        index = torch.from_numpy(np.column_stack([rows[pick] - start, points[pick]]).T).to(device)
+        batch[index[0], 0, index[1], index[2], index[3]] = 1
+        toned = tone(batch, backend)
+
+        mine = np.flatnonzero((home >= start) & (home < stop))
+        at = torch.from_numpy(np.column_stack([home[mine] - start, local[mine] + 1]).T).to(device)
+        labels[mine] = toned[at[0], 0, at[1], at[2], at[3]].long().cpu().numpy()
+    return voxels.with_values(labels)
+
+def two_tone_sparse(voxels, tile=16, chunk_size=64, backend='torch'):
+    return tone_sparse(two_tone, voxels, tile, chunk_size, backend)
+
+def three_tone_sparse(voxels, tile=16, chunk_size=64, backend='torch'):
+    return tone_sparse(three_tone, voxels, tile, chunk_size, backend)
+
+def tile_slices(shape, tile):
+    '''the tile^3 blocks of a grid of the given shape as slice triples (smaller at the far edges)'''
+    for corner in itertools.product(*(range(0, size, tile) for size in shape)):
+        yield tuple(slice(c, min(c + tile, size)) for c, size in zip(corner, shape))
+
+def cut(data, lo, size):
+    '''
+    the size block of data starting at corner lo (which may lie outside the grid) as float32,
+    zeros past the edges of the grid like conv3d's padding
+    '''
+    lo = np.asarray(lo)
+    hi = lo + size
+    block = np.zeros(size, dtype=np.float32)
+    src = tuple(slice(max(l, 0), min(h, s)) for l, h, s in zip(lo, hi, data.shape))
+    dst = tuple(slice(s.start - l, s.stop - l) for s, l in zip(src, lo))
+    block[dst] = data[src]
+    return block
+
+@instrument.traced('erosion.tone_tiled')
+def tone_tiled(tone, data, out=None, tile=128, backend='numpy', workers=None, dtype=None):
+    '''
+    tone: two_tone or three_tone
+    data: (D, H, W) np array, e.g. a np.memmap or np.load(path, mmap_mode='r'), or the path of a .npy
+    out: (D, H, W) np array to write the labels into, or the path of a .npy to create as a memmap
+    tones the grid tile^3 voxels at a time: each tile is read with a 1 voxel halo (zeros past the
+    edges of the grid, like conv3d's padding), toned, and only its core written to out, so memory
+    stays at a few tiles whatever the grid size. the labels are identical to tone() on the whole grid.
+    - workers: tone this many tiles at once in a thread pool (torch and numpy release the GIL)
+    - dtype: of a new out, default data's dtype (uint8 for bool)
+    returns out
+    '''
+    if isinstance(data, (str, os.PathLike)):
+        data = np.load(data, mmap_mode='r')
+    if dtype is None:
+        dtype = np.uint8 if data.dtype == bool else data.dtype
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype)
+    elif isinstance(out, (str, os.PathLike)):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=data.shape)
+
+    def run(core):
+        block = cut(data, [c.start - 1 for c in core], [c.stop - c.start + 2 for c in core])
+        toned = tone(torch.from_numpy(block)[None, None].to(device), backend)
+        out[core] = toned[0, 0, 1:-1, 1:-1, 1:-1].cpu().numpy()
+
+    with ThreadPoolExecutor(workers or 1) as pool:
+        for _ in pool.map(run, tile_slices(data.shape, tile)):
+            pass
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+def two_tone_tiled(data, out=None, tile=128, backend='numpy', workers=None, dtype=None):
+    return tone_tiled(two_tone, data, out, tile, backend, workers, dtype)
+
+def three_tone_tiled(data, out=None, tile=128, backend='numpy', workers=None, dtype=None):
+    return tone_tiled(three_tone, data, out, tile, backend, workers, dtype)
+
+@instrument.traced('erosion.retone')
+def retone(tone, data, toned, changed, values=None, tile=8, chunk_size=64, backend='torch'):
+    '''
+    tone: two_tone or three_tone
+    data: (D, H, W) np array that toned was made from; the edit is written into it
+    toned: (D, H, W) np array, tone()'s labels for data before the edit; updated in place
+    changed: (n, 3) int coords of the edited voxels
+    values: the new data at changed, or None if data already holds the edit
+    every detector looks at a 3x3x3 neighborhood, so an edit can only relabel the voxels within 1 voxel
+    of it. only those are recomputed: the tile^3 blocks holding them are cut out with a 2 voxel margin
+    (the neighborhoods of their neighborhoods) and toned chunk_size at a time.
+    returns (coords, labels): the voxels whose label changed and their new labels, so only those
+    need to be placed again (see sendit.places_voxels)
+    '''
+    changed = np.asarray(changed, dtype=np.int64).reshape(-1, 3)
+    if values is not None:
+        data[tuple(changed.T)] = values
+    steps = np.array(list(np.ndindex(3, 3, 3))) - 1
+    near = (changed[:, None] + steps[None]).reshape(-1, 3)
+    near = np.unique(near[np.all((near >= 0) & (near < np.array(data.shape)), axis=1)], axis=0)
+    if len(near) == 0:
+        return near, toned[tuple(near.T)]
+
+    tiles, home = np.unique(near // tile, axis=0, return_inverse=True)
+    home = home.ravel()
+    local = near - tiles[home] * tile + 2
+    side = tile + 4
+    labels = np.empty(len(near), dtype=toned.dtype)
+    for start in range(0, len(tiles), chunk_size):
+        stop = min(start + chunk_size, len(tiles))
+        batch = np.stack([cut(data, corner * tile - 2, (side,) * 3) for corner in tiles[start:stop]])
+        relabelled = tone(torch.from_numpy(batch)[:, None].to(device), backend)[:, 0].cpu().numpy()
+        mine = (home >= start) & (home < stop)
+        labels[mine] = relabelled[home[mine] - start, local[mine, 0], local[mine, 1], local[mine, 2]]
+
+    diff = labels != toned[tuple(near.T)]
+    coords, labels = near[diff], labels[diff]
+    toned[tuple(coords.T)] = labels
+    return coords, labels
+
+def two_tone_retone(data, toned, changed, values=None, tile=8, chunk_size=64, backend='torch'):
+    return retone(two_tone, data, toned, changed, values, tile, chunk_size, backend)
 
-def three_tone(data):
-    pillar1 = pillars(data)
-    pillar2 = pillars2(data)
-    pillar_merged = merge_arrays([pillar1, pillar2])
-    wall_blocks = walls(data)
-    merged = merge_arrays([data, wall_blocks * 2, pillar_merged * 3])
-    return merged
\ No newline at end of file
+def three_tone_retone(data, toned, changed, values=None, tile=8, chunk_size=64, backend='torch'):
+    return retone(three_tone, data, toned, changed, values, tile, chunk_size, backend)
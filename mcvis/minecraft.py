@@ -4,8 +4,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.utils.data import DataLoader, Dataset
-from erosion import two_tone, three_tone
+from erosion import two_tone, three_tone, three_tone_batch
 from sendit import places
+from components import cleanup
 import random
 
 sample_houses = np.load('samples.npy')
@@ -31,6 +32,10 @@ def visualize_house(vox, ids=False):
 
 
 houses_np = sample_houses > 0.8
+# drop floating specks and debris: components under 8 voxels or not touching the ground layer
+cleaned = cleanup(houses_np, min_size=8)
+print(f"cleanup removed {houses_np.sum() - cleaned.sum()} of {houses_np.sum()} voxels")
+houses_np = cleaned
 print(np.unique(houses_np, return_counts=True))
 ds = torch.from_numpy(np.float32(houses_np)).to(device)
 print(ds.shape)
@@ -52,15 +57,20 @@ modern = [
             "minecraft:glass",
             "minecraft:stone_bricks"
         ]
+# or generate one from a color per tone: the opaque full blocks nearest to each (in Lab), two picks per tone
+# from quantize import Quantizer, full_block
+# sandstone_generated = Quantizer(metric='lab', opaque=True, allow=full_block).make_palette(
+#     [(216, 202, 155), (180, 140, 90), (120, 90, 60)], variety=2)
     
 palette = modern
 
+# tone every sample at once, (N, 1, D, H, W) -> (N, D, H, W, 1)
+toned = three_tone_batch(ds, chunk_size=16).permute(0,2,3,4,1).cpu().numpy()
 for i in range(8):
     for j in range(8):
-        # random_house = random.choice(ds)
-        random_house = ds[i*8 + j]
-        res = three_tone(random_house).permute(1,2,3,0)
-        places(res.cpu().numpy(), i*32, j*32, True, palette)
+        # random_house = random.choice(toned)
+        res = toned[i*8 + j]
+        places(res, i*32, j*32, True, palette)
 
 # three_tone_res = three_tone(random_house).permute(1,2,3,0)
 # places(three_tone_res.cpu().numpy(), 0, 32, False, palette)
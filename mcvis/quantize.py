@@ -0,0 +1,189 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+AVGS_CSV = Path(__file__).parent.parent / "scraper/grabcraft-to-schema/data/blockmodel_avgs.csv"
+AIR = "minecraft:air"
+METRICS = ('rgb', 'lab')
+
+
+# name parts of blocks that are not full cubes; their model averages are opaque but they don't build walls
+PARTIAL_BLOCKS = ('_slab', '_stairs', '_wall', '_fence', '_door', '_trapdoor', '_sign', '_button', '_pressure_plate',
+                  '_pane', '_carpet', '_banner', '_bed', '_candle', '_rod', '_chain', '_lantern', '_torch', '_rail',
+                  '_head', '_skull', '_coral', '_sapling', '_flower', '_bars', 'ladder', 'lever', 'button', 'chest')
+
+
+def full_block(name):
+    '''
+    allow-list predicate for Quantizer: False for slabs, stairs, fences, doors, signs, ...
+    '''
+    return not any(part in name for part in PARTIAL_BLOCKS)
+
+
+def srgb_to_lab(rgb):
+    '''
+    (..., 3) sRGB in [0, 255] -> CIE Lab (D65)
+    '''
+    c = np.asarray(rgb, dtype=np.float64) / 255
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193],
+                        [0.3576, 0.7152, 0.1192],
+                        [0.1805, 0.0722, 0.9505]])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def load_avgs(csv_path=AVGS_CSV):
+    '''
+    block names and their (n, 4) average RGBA from blockmodel_avgs.csv
+    '''
+    data = np.genfromtxt(csv_path, delimiter=',', skip_header=1, dtype=None, encoding=None)
+    names = ["minecraft:" + row[0] for row in data]
+    colors = np.array([list(row)[1:] for row in data], dtype=np.float64)
+    return names, colors
+
+
+class Quantizer:
+    def __init__(self, csv_path=AVGS_CSV, metric='rgb', opaque=False, allow=None, bits=6, cache_dir=None,
+                 exact=False, alpha=False, prefer=None):
+        '''
+        maps RGB(A) colors to the block with the nearest average color; the one color -> block mapping
+        for every dataset tool (voxel_corpus.py, slice_dataset.py)
+        - metric: 'rgb' (euclidean on sRGB) or 'lab' (euclidean on CIE Lab, closer to perceived difference)
+        - opaque: only consider blocks whose average alpha is 255 (full cubes, no glass/doors/flowers)
+        - allow: only consider these block names (with or without the minecraft: prefix), or a predicate on the name
+        - bits: resolution of the lookup cube, 2**bits levels per channel
+        - cache_dir: save the lookup cube here and reuse it next time
+        - exact: search every distinct color instead of reading the cube by default, see __call__
+        - alpha: match RGBA instead of RGB, so glass, doors and leaves are told apart from opaque blocks
+          of the same color (needs metric='rgb' and exact, the cube is RGB only)
+        - prefer: predicate on the name; blocks it accepts come first in self.names, so they win ties
+          between blocks of the same average color (e.g. full_block: oak_planks over oak_stairs)
+        quantized ids index self.palette: 0 is air (transparent input), i + 1 is self.names[i]
+        blocks whose average alpha is 0 (air, cave_air, barrier, light, ...) are never candidates
+        '''
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric!r}, expected one of {METRICS}")
+        names, colors = load_avgs(csv_path)
+        keep = colors[:, 3] > 0
+        if opaque:
+            keep &= colors[:, 3] >= 255
+        if allow is not None:
+            if not callable(allow):
+                allowed = {a if ':' in a else "minecraft:" + a for a in allow}
+                allow = allowed.__contains__
+            keep &= np.array([bool(allow(name)) for name in names])
+        if not keep.any():
+            raise ValueError("no blocks left to quantize to")
+        if alpha and (metric != 'rgb' or not exact):
+            raise ValueError("alpha matching needs metric='rgb' and exact=True")
+
+        order = np.flatnonzero(keep)
+        if prefer is not None:
+            order = order[np.argsort([not prefer(names[i]) for i in order], kind='stable')]
+        self.names = [names[i] for i in order]
+        self.colors = colors[order]
+        self.palette = [AIR] + self.names
+        self.metric = metric
+        self.bits = bits
+        self.cache_dir = cache_dir
+        self.exact = exact
+        self.channels = 4 if alpha else 3
+        self._points = self.to_space(self.colors[:, :self.channels])
+        self._cube = None
+
+    def to_space(self, rgb):
+        return srgb_to_lab(rgb) if self.metric == 'lab' else np.asarray(rgb, dtype=np.float64)
+
+    def nearest(self, rgb, k=1, chunk=1 << 12):
+        '''
+        exact search: (..., 3) colors, or (..., 4) with alpha -> (..., k) indices into self.names, nearest first
+        chunk colors are compared at a time, each step holds a few (chunk, len(self.names)) float64 arrays
+        '''
+        rgb = np.asarray(rgb)
+        flat = self.to_space(rgb.reshape(-1, self.channels))
+        out = np.empty((len(flat), k), dtype=np.int64)
+        p2 = (self._points ** 2).sum(1)
+        for start in range(0, len(flat), chunk):
+            q = flat[start:start + chunk]
+            dist = p2[None] - 2 * q @ self._points.T
+            if k == 1:
+                out[start:start + chunk, 0] = dist.argmin(1)
+            else:
+                part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+                order = np.take_along_axis(dist, part, 1).argsort(1)
+                out[start:start + chunk] = np.take_along_axis(part, order, 1)
+        return out.reshape(rgb.shape[:-1] + (k,))
+
+    @property
+    def cube(self):
+        '''
+        (2**bits)**3 table of the nearest block (index into self.names) for the center of every color cell
+        '''
+        if self._cube is not None:
+            return self._cube
+        if self.channels == 4:
+            raise ValueError("alpha matching needs exact=True, the cube is RGB only")
+        path = None
+        if self.cache_dir:
+            key = hashlib.sha1("\n".join([self.metric, str(self.bits)] + self.names).encode()).hexdigest()[:16]
+            path = Path(self.cache_dir) / f"quantize_cube_{key}.npy"
+            if path.exists():
+                self._cube = np.load(path)
+                return self._cube
+
+        levels = 1 << self.bits
+        centers = (np.arange(levels) + 0.5) * (256 / levels)
+        grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1)
+        self._cube = self.nearest(grid.reshape(-1, 3))[:, 0].astype(np.uint16)
+
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp.npy")
+            np.save(tmp, self._cube)
+            os.replace(tmp, path)
+        return self._cube
+
+    def __call__(self, rgba, exact=None, alpha_threshold=0):
+        '''
+        (..., 3) or (..., 4) uint8 colors -> (...) int ids into self.palette
+        alpha at or below alpha_threshold is air. With exact=True every distinct color is searched
+        instead of reading the cube (slower, but not limited to the cube resolution); None uses self.exact.
+        '''
+        rgba = np.asarray(rgba)
+        if self.exact if exact is None else exact:
+            colors, inverse = np.unique(rgba.reshape(-1, rgba.shape[-1]), axis=0, return_inverse=True)
+            ids = self.nearest(colors[:, :self.channels])[:, 0][inverse.ravel()].reshape(rgba.shape[:-1]) + 1
+        elif self.channels == 4:
+            raise ValueError("alpha matching needs exact=True")
+        else:
+            shift = 8 - self.bits
+            c = rgba[..., :3].astype(np.uint32) >> shift
+            ids = self.cube[(c[..., 0] << (2 * self.bits)) | (c[..., 1] << self.bits) | c[..., 2]].astype(np.int32) + 1
+        if rgba.shape[-1] == 4:
+            ids[rgba[..., 3] <= alpha_threshold] = 0
+        return ids
+
+    def blocks(self, rgba, **kwargs):
+        '''
+        like __call__, but block names
+        '''
+        return np.array(self.palette, dtype=object)[self(rgba, **kwargs)]
+
+    def make_palette(self, colors, variety=1):
+        '''
+        an mcvis palette (see sendit.resolve) for the tone labels 1, 2, 3, ... from one color per label
+        - colors: RGB per label, e.g. [(230, 225, 215), (180, 200, 210), (120, 120, 120)]
+        - variety: with more than 1, each label gets a tuple of its nearest blocks, placed at random
+        '''
+        colors = np.asarray(colors, dtype=np.float64)
+        if self.channels == 4 and colors.shape[-1] == 3:
+            colors = np.concatenate([colors, np.full(colors.shape[:-1] + (1,), 255.0)], axis=-1)
+        palette = [AIR]
+        for row in self.nearest(colors, k=variety):
+            picks = tuple(self.names[i] for i in row)
+            palette.append(picks[0] if variety == 1 else picks)
+        return palette
@@ -1,36 +1,261 @@
+import sys
+import time
+from pathlib import Path
+import numpy as np
 import requests
-import random
+sys.path.append(str(Path(__file__).resolve().parent.parent / "utils"))  # instrument.py
+import instrument
+from sparse import SparseVoxels
 
-def places(np3d, offset_x=0, offset_y=0, clear_space=True, palette=["minecraft:air", "minecraft:cobblestone", "minecraft:oak_planks", "minecraft:oak_log"]):
+URL = "http://localhost:9000/blocks?x=0&y=0&z=0"
+COMMAND_URL = "http://localhost:9000/commands?x=0&y=0&z=0"
+# the most blocks a single /fill command may change
+FILL_LIMIT = 32768
+DEFAULT_PALETTE = ["minecraft:air", "minecraft:cobblestone", "minecraft:oak_planks", "minecraft:oak_log"]
+
+# one pooled connection to the HTTP interface, reused by every upload
+session = requests.Session()
+
+def resolve(np3d, palette=DEFAULT_PALETTE, seed=None):
     '''
-    places the given np3d array at the given offset in the world
-    - clear_space: if True, will place air blocks
+    picks a block id for every voxel of the np3d array
     - palette: block ids for values 0, 1, 2, 3 in the np3d array; if a tuple, will randomly choose one of the block ids
+    - seed: seed for the random choices, so a placement can be repeated exactly
+    returns (block, choices): block[x, y, z] is the index into choices of the voxel's block id
+    '''
+    return pick(np3d[..., 0].astype(np.intp), palette, seed)
+
+def pick(labels, palette=DEFAULT_PALETTE, seed=None):
+    '''resolve() for an int array of labels of any shape, e.g. the values of a SparseVoxels'''
+    # each palette entry is the range [start, start + count) of a flat list of choices
+    choices, starts, counts = [], [], []
+    for block_id in palette:
+        options = block_id if isinstance(block_id, tuple) else (block_id,)
+        starts.append(len(choices))
+        counts.append(len(options))
+        choices.extend(options)
+    starts, counts, choices = np.array(starts), np.array(counts), np.array(choices)
+
+    rng = np.random.default_rng(seed)
+    return starts[labels] + rng.integers(counts[labels]), choices
+
+def palette_for(np3d, palette=None):
+    '''the palette to place np3d with: palette if given, else a SparseVoxels' own palette, else DEFAULT_PALETTE'''
+    if palette is None and isinstance(np3d, SparseVoxels):
+        palette = np3d.palette
+    return DEFAULT_PALETTE if palette is None else palette
+
+def world_coords(dx, dy, dz, offset_x=0, offset_y=0):
+    '''np3d indices to minecraft x, y, z'''
+    # y is up in minecraft
+    return dx + offset_x, dz - 61, dy + offset_y
+
+@instrument.traced('sendit.encode')
+def encode(np3d, offset_x=0, offset_y=0, clear_space=True, palette=None, seed=None):
+    '''
+    turns the np3d array into world coordinates and block ids with array ops
+    - clear_space: if True, will keep air blocks
+    - palette, seed: see resolve(); palette defaults to np3d.palette for a SparseVoxels (see palette_for())
+    np3d may also be a sparse.SparseVoxels, which only holds solid voxels, so only those are encoded
+    (clear_space is ignored, places() clears the grid with /fill commands instead)
+    returns (coords, ids): an (n, 3) int array of world x, y, z and an (n,) array of block ids,
+    sorted by chunk so that consecutive uploads touch as few chunks as possible
     '''
-    x, y, z, one = np3d.shape
-
-    url = "http://localhost:9000/blocks?x=0&y=0&z=0"
-    blocks = []
-    for dx in range(x):
-        for dy in range(y):
-            for dz in range(z):
-                block_id = palette[int(np3d[dx, dy, dz, 0])]
-                if not clear_space and block_id == "minecraft:air":
-                    continue
-                if isinstance(block_id, tuple):
-                    block_id = random.choice(block_id)
-                block = {
-                        "id": block_id,  # block id
-                        "x": dx + offset_x,  
-                        "y": dz - 61,   # y is up in minecraft 
-                        "z": dy + offset_y,
-                    }
-                blocks.append(block)
-                    
-                
-    print(blocks)
-    response = requests.put(url, json=blocks)
-    if response.status_code == 200:
-        print("Successfully placed wood blocks!")
+    palette = palette_for(np3d, palette)
+    if isinstance(np3d, SparseVoxels):
+        block, choices = pick(np3d.values.astype(np.intp), palette, seed)
+        solid = choices[block] != "minecraft:air"
+        dx, dy, dz = np3d.coords[solid].T
+        ids = choices[block[solid]]
     else:
-        print("Error placing blocks:", response.text)
+        block, choices = resolve(np3d, palette, seed)
+        keep = np.ones(len(choices), dtype=bool) if clear_space else choices != "minecraft:air"
+        dx, dy, dz = np.nonzero(keep[block])
+        ids = choices[block[dx, dy, dz]]
+
+    coords = np.stack(world_coords(dx, dy, dz, offset_x, offset_y), axis=1)
+    order = np.lexsort((coords[:, 2] >> 4, coords[:, 0] >> 4))
+    return coords[order], ids[order]
+
+def upload(coords, ids, url=None, batch_size=4096):
+    '''
+    PUTs the blocks to the GDMC /blocks endpoint (URL unless given), batch_size blocks per request, over the shared session.
+    returns True if every request succeeded
+    '''
+    url = url or URL
+    ok = True
+    for start in range(0, len(ids), batch_size):
+        t0 = time.perf_counter()
+        with instrument.span('sendit.payload'):
+            xs, ys, zs = coords[start:start + batch_size].T.tolist()
+            blocks = [
+                {"id": block_id, "x": x, "y": y, "z": z}
+                for block_id, x, y, z in zip(ids[start:start + batch_size].tolist(), xs, ys, zs)
+            ]
+        with instrument.span('sendit.http', blocks=len(blocks)):
+            response = session.put(url, json=blocks)
+        instrument.count('sendit.requests')
+        instrument.count('sendit.blocks', len(blocks))
+        instrument.count('sendit.bytes', len(response.request.body or b""))
+        if response.status_code != 200:
+            ok = False
+            print("Error placing blocks:", response.text)
+        print(f"placed blocks {start}-{start + len(blocks)} of {len(ids)} in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    return ok
+
+@instrument.traced('sendit.boxes')
+def boxes(block, keep, limit=FILL_LIMIT):
+    '''
+    greedily splits the kept voxels of block into axis-aligned boxes of a single block index.
+    starting from the first uncovered voxel, each box grows along z, then y, then x,
+    as long as every voxel it takes is uncovered, kept and the same block, up to limit voxels.
+    returns an (n, 7) int array of x0, y0, z0, x1, y1, z1 (inclusive) and the block index
+    '''
+    todo = keep.copy()
+    size_x, size_y, _ = block.shape
+    found = []
+    for x, y, z in np.argwhere(keep).tolist():
+        if not todo[x, y, z]:
+            continue
+        value = block[x, y, z]
+
+        row = todo[x, y, z:] & (block[x, y, z:] == value)
+        dz = min(len(row) if row.all() else int(row.argmin()), limit)
+
+        def fits(region):
+            return todo[region].all() and (block[region] == value).all()
+
+        dy = 1
+        while y + dy < size_y and dz * (dy + 1) <= limit and fits((x, y + dy, slice(z, z + dz))):
+            dy += 1
+        dx = 1
+        while x + dx < size_x and dz * dy * (dx + 1) <= limit and fits((x + dx, slice(y, y + dy), slice(z, z + dz))):
+            dx += 1
+
+        todo[x:x + dx, y:y + dy, z:z + dz] = False
+        found.append((x, y, z, x + dx - 1, y + dy - 1, z + dz - 1, value))
+    return np.array(found, dtype=np.intp).reshape(-1, 7)
+
+def clear_commands(shape, offset_x=0, offset_y=0, limit=FILL_LIMIT):
+    '''
+    /fill ... minecraft:air commands that together cover a grid of the given (D, H, W) shape
+    at the given offset, each changing at most limit blocks
+    '''
+    size_x, size_y, size_z = shape
+    step_z = min(size_z, limit)
+    step_y = min(size_y, max(limit // step_z, 1))
+    step_x = min(size_x, max(limit // (step_z * step_y), 1))
+    commands = []
+    for x in range(0, size_x, step_x):
+        for y in range(0, size_y, step_y):
+            for z in range(0, size_z, step_z):
+                x0, y0, z0 = world_coords(x, y, z, offset_x, offset_y)
+                x1, y1, z1 = world_coords(min(x + step_x, size_x) - 1, min(y + step_y, size_y) - 1,
+                                          min(z + step_z, size_z) - 1, offset_x, offset_y)
+                commands.append(f"fill {x0} {y0} {z0} {x1} {y1} {z1} minecraft:air")
+    return commands
+
+def run_commands(commands, url=None, batch_size=1024):
+    '''
+    POSTs the commands to the GDMC /commands endpoint (COMMAND_URL unless given), batch_size lines per request,
+    over the shared session. returns True if every request succeeded
+    '''
+    url = url or COMMAND_URL
+    ok = True
+    for start in range(0, len(commands), batch_size):
+        t0 = time.perf_counter()
+        batch = commands[start:start + batch_size]
+        body = "\n".join(batch)
+        with instrument.span('sendit.http', commands=len(batch)):
+            response = session.post(url, data=body)
+        instrument.count('sendit.requests')
+        instrument.count('sendit.commands', len(batch))
+        instrument.count('sendit.bytes', len(body))
+        if response.status_code != 200:
+            ok = False
+            print("Error running commands:", response.text)
+        print(f"ran commands {start}-{start + len(batch)} of {len(commands)} in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    return ok
+
+@instrument.traced('sendit.places_fill')
+def places_fill(np3d, offset_x=0, offset_y=0, clear_space=True, palette=DEFAULT_PALETTE, seed=None,
+                batch_size=4096, min_volume=2):
+    '''
+    places the given np3d array as /fill commands, one per box of identical blocks (see boxes()).
+    boxes smaller than min_volume are left over and sent as individual blocks.
+    returns the compression ratio: voxels placed / (fill commands + leftover blocks)
+    '''
+    block, choices = resolve(np3d, palette, seed)
+    keep = np.ones(len(choices), dtype=bool) if clear_space else choices != "minecraft:air"
+    found = boxes(block, keep[block])
+    volume = np.prod(found[:, 3:6] - found[:, 0:3] + 1, axis=1)
+    fills, leftover = found[volume >= min_volume], found[volume < min_volume]
+
+    x0, y0, z0 = world_coords(fills[:, 0], fills[:, 1], fills[:, 2], offset_x, offset_y)
+    x1, y1, z1 = world_coords(fills[:, 3], fills[:, 4], fills[:, 5], offset_x, offset_y)
+    commands = [
+        f"fill {a} {b} {c} {d} {e} {f} {block_id}"
+        for a, b, c, d, e, f, block_id in zip(
+            x0.tolist(), y0.tolist(), z0.tolist(), x1.tolist(), y1.tolist(), z1.tolist(),
+            choices[fills[:, 6]].tolist(),
+        )
+    ]
+    ok = run_commands(commands)
+
+    # leftover boxes are single voxels unless min_volume > 2, so send every voxel they cover
+    cells = [
+        (x, y, z, value)
+        for a, b, c, d, e, f, value in leftover.tolist()
+        for x in range(a, d + 1) for y in range(b, e + 1) for z in range(c, f + 1)
+    ]
+    cells = np.array(cells, dtype=np.intp).reshape(-1, 4)
+    coords = np.stack(world_coords(cells[:, 0], cells[:, 1], cells[:, 2], offset_x, offset_y), axis=1)
+    ok = upload(coords, choices[cells[:, 3]], batch_size=batch_size) and ok
+
+    voxels = int(volume.sum())
+    operations = len(commands) + len(cells)
+    ratio = voxels / max(operations, 1)
+    print(f"{voxels} voxels in {len(commands)} fills + {len(cells)} blocks, compression {ratio:.1f}x")
+    if ok:
+        print(f"Successfully placed {voxels} blocks!")
+    return ratio
+
+@instrument.traced('sendit.places')
+def places(np3d, offset_x=0, offset_y=0, clear_space=True, palette=None, seed=None, batch_size=4096,
+           fill=False):
+    '''
+    places the given np3d array at the given offset in the world
+    - clear_space: if True, will place air blocks
+    - palette: block ids for values 0, 1, 2, 3 in the np3d array; if a tuple, will randomly choose one of the block ids.
+      Defaults to np3d.palette for a SparseVoxels that has one, else DEFAULT_PALETTE
+    - seed: seed for the random choices of tuple palette entries
+    - batch_size: number of blocks sent per request
+    - fill: if True, place uniform boxes with /fill commands instead (see places_fill())
+    np3d may be a sparse.SparseVoxels: then only its solid voxels are sent, after clearing the grid
+    with a few /fill air commands if clear_space
+    '''
+    palette = palette_for(np3d, palette)
+    if isinstance(np3d, SparseVoxels):
+        if fill:
+            np3d = np3d.to_dense()[..., None]
+        elif clear_space:
+            run_commands(clear_commands(np3d.shape, offset_x, offset_y))
+    if fill:
+        return places_fill(np3d, offset_x, offset_y, clear_space, palette, seed, batch_size)
+    coords, ids = encode(np3d, offset_x, offset_y, clear_space, palette, seed)
+    if upload(coords, ids, batch_size=batch_size):
+        print(f"Successfully placed {len(ids)} blocks!")
+
+@instrument.traced('sendit.places_voxels')
+def places_voxels(coords, labels, offset_x=0, offset_y=0, palette=DEFAULT_PALETTE, seed=None, batch_size=4096):
+    '''
+    places just the given voxels, air included, e.g. the ones erosion.retone() relabelled after an edit
+    - coords: (n, 3) int array of np3d indices
+    - labels: (n,) their labels, 0 for air
+    - palette, seed: see resolve()
+    '''
+    block, choices = pick(np.asarray(labels).astype(np.intp), palette, seed)
+    coords = np.asarray(coords).reshape(-1, 3)
+    world = np.stack(world_coords(coords[:, 0], coords[:, 1], coords[:, 2], offset_x, offset_y), axis=1)
+    if upload(world, choices[block], batch_size=batch_size):
+        print(f"Successfully placed {len(block)} blocks!")
@@ -0,0 +1,93 @@
+import numpy as np
+import torch
+
+'''
+sparse voxel grids: only the solid voxels are stored, as a coordinate list plus a label per voxel,
+so memory and the work done on a build scale with its solid voxels rather than its volume.
+'''
+
+class SparseVoxels:
+    '''
+    - coords: (n, 3) int array of x, y, z indices, in C order (sorted by x, then y, then z); z is up,
+      as in erosion.py, so minecraft's x, y, z are the grid's x, z, y (see minecraft_coords())
+    - values: (n,) int array of labels, never 0 (0 is empty / air and is not stored)
+    - shape: (D, H, W) of the dense grid
+    - palette: optional block ids per label, as for sendit.places (label 0 is air)
+    '''
+    def __init__(self, coords, values, shape, palette=None):
+        self.coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+        self.values = np.asarray(values).reshape(-1)
+        self.shape = tuple(int(s) for s in shape)
+        self.palette = palette
+
+    @classmethod
+    def from_dense(cls, data, palette=None):
+        '''
+        data: np array or torch tensor of shape (D, H, W) or (D, H, W, 1), e.g. a toned house from erosion
+        '''
+        if isinstance(data, torch.Tensor):
+            data = data.detach().cpu().numpy()
+        if data.ndim == 4:
+            data = data[..., 0]
+        coords = np.argwhere(data)
+        return cls(coords, data[tuple(coords.T)], data.shape, palette)
+
+    def to_dense(self, dtype=None):
+        '''(D, H, W) np array, 0 where no voxel is stored'''
+        dense = np.zeros(self.shape, dtype=dtype or self.values.dtype)
+        dense[tuple(self.coords.T)] = self.values
+        return dense
+
+    def to_torch(self, device=None, dtype=torch.float32):
+        '''(1, D, H, W) tensor, the layout erosion.py works on'''
+        dense = torch.zeros(self.shape, device=device, dtype=dtype)
+        index = torch.from_numpy(self.coords.T).to(dense.device)
+        dense[tuple(index)] = torch.as_tensor(self.values, device=dense.device, dtype=dtype)
+        return dense.unsqueeze(0)
+
+    def with_values(self, values):
+        '''same voxels, new labels (voxels whose new label is 0 are dropped)'''
+        values = np.asarray(values).reshape(-1)
+        keep = values != 0
+        return SparseVoxels(self.coords[keep], values[keep], self.shape, self.palette)
+
+    def resolve(self, palette=None, seed=None):
+        '''
+        same voxels with a plain block id per value: every voxel draws its own pick from tuple
+        palette entries (see sendit.pick), and the values index the flat list of picks that becomes the palette
+        - palette: default self.palette
+        '''
+        from sendit import pick  # sendit imports this module
+        palette = self.palette if palette is None else palette
+        if palette is None:
+            raise ValueError("no palette to resolve")
+        block, choices = pick(self.values.astype(np.intp), palette, seed)
+        return SparseVoxels(self.coords, block, self.shape, choices.tolist())
+
+    def minecraft_coords(self):
+        '''
+        (n, 3) coords in minecraft's x, y, z order, y being up: the mapping sendit.world_coords
+        applies (without its offsets) and LitematicaBuilder.place_sparse uses
+        '''
+        return self.coords[:, [0, 2, 1]]
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes + self.values.nbytes
+
+    def bbox(self):
+        '''(lo, hi) inclusive corners of the stored voxels, None if there are none'''
+        if len(self) == 0:
+            return None
+        return self.coords.min(axis=0), self.coords.max(axis=0)
+
+    def tiles(self, size):
+        '''
+        the size^3 tiles of the grid that hold at least one voxel, as a (t, 3) array of tile
+        indices (the tile's corner is index * size), and the tile of every voxel as a (n,) index into them
+        '''
+        tile_coords = self.coords // size
+        return np.unique(tile_coords, axis=0, return_inverse=True)
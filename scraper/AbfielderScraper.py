@@ -1,14 +1,113 @@
 import cloudscraper
 from bs4 import BeautifulSoup
 import os
+import hashlib
+import json
 import logging
+import queue
+import tempfile
+import threading
+import time
+import requests
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent / "utils"))  # instrument.py
+import instrument
+
+# Downloads are streamed in 1 MiB chunks to <pid>-<random>.part temp files, see AbfielderScraper.store()
+CHUNK_SIZE = 1 << 20
+PART_SUFFIX = ".part"
+# Where a pid can't be checked (Windows), .part files untouched this long count as abandoned
+STALE_PART_SECONDS = 3600
+
+
+def status(response):
+    """Status code for log messages, None if the request never got a response."""
+    return None if response is None else response.status_code
+
+
+def stale_part(path):
+    """
+    True if the .part file at path was left by a scraper that is no longer running, so a scraper
+    starting in the same output directory never deletes another one's in-flight downloads.
+    """
+    pid = os.path.basename(path).partition("-")[0]
+    if not pid.isdigit():
+        return True
+    if os.name == "nt":  # os.kill would terminate the process there
+        return time.time() - os.path.getmtime(path) > STALE_PART_SECONDS
+    try:
+        os.kill(int(pid), 0)
+    except (ProcessLookupError, OverflowError):
+        return True
+    except PermissionError:
+        pass  # running, as another user
+    return False
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second=None):
+        """
+        Spaces calls to wait() at least 1 / requests_per_second seconds apart, across threads.
+        No limit if requests_per_second is None.
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+        time.sleep(slot - now)
+
+
+class Manifest:
+    def __init__(self, path):
+        """
+        Append-only JSONL record of finished detail pages and downloaded files, so runs can resume.
+        Each line is {"detail": id} or {"file": name, "sha256": digest, "path": stored file name}.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.details = set()
+        self.files = {}  # downloaded name -> sha256
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # a torn last line from an interrupted run
+
+    def _apply(self, record):
+        if "detail" in record:
+            self.details.add(record["detail"])
+        if "file" in record:
+            self.files[record["file"]] = record["sha256"]
+
+    def add(self, record):
+        with self.lock:
+            self._apply(record)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
 
 
 class AbfielderScraper:
-    def __init__(self, base_url, output_dir, log_file="cloud_scraper.log"):
+    def __init__(self, base_url, output_dir, log_file="cloud_scraper.log", requests_per_second=None, retries=3,
+                 backoff=1.0, manifest_path=None):
         self.base_url = base_url
         self.output_dir = output_dir
         self.visited_files = set()
+        self.visited_lock = threading.Lock()
+
+        # Politeness and robustness for every GET, see fetch()
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
 
         # Create a cloudscraper instance instead of requests session
         self.session = cloudscraper.create_scraper(
@@ -26,83 +125,219 @@ class AbfielderScraper:
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-    def scrape_page(self, page_number):
+        # Resume from the manifest of previous runs and drop their unfinished downloads
+        self.manifest = Manifest(manifest_path or os.path.join(self.output_dir, "manifest.jsonl"))
+        self.visited_files.update(self.manifest.files)
+        for name in os.listdir(self.output_dir):
+            path = os.path.join(self.output_dir, name)
+            try:
+                if name.endswith(PART_SUFFIX) and stale_part(path):
+                    os.remove(path)
+            except FileNotFoundError:
+                continue  # finished, or removed by another scraper starting up
+
+    def fetch(self, url, **kwargs):
         """
-        Scrape the main listing page for litematic links.
+        GET the url through the rate limiter, retrying non-200 responses and connection errors
+        with exponential backoff. Returns the last response, or None if every attempt raised.
+        """
+        response = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                instrument.count("scraper.retries")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            with instrument.span("scraper.rate_limit"):
+                self.rate_limiter.wait()
+            instrument.count("scraper.requests")
+            try:
+                with instrument.span("scraper.http", url=url):
+                    response = self.session.get(url, **kwargs)
+            except requests.RequestException as e:
+                self.logger.warning(f"Request failed: {url} ({e}) (attempt {attempt + 1}/{self.retries + 1})")
+                continue
+            if response.status_code == 200:
+                return response
+            self.logger.warning(
+                f"Got status {response.status_code} for {url} (attempt {attempt + 1}/{self.retries + 1})"
+            )
+        return response
+
+    @instrument.traced("scraper.listing_page")
+    def listing_links(self, page_number):
+        """
+        Fetch a main listing page and return the detail page URLs on it.
         """
         url = f"{self.base_url}/tags/House/{page_number}/popular"
         self.logger.info(f"Scraping page: {url}")
 
-        response = self.session.get(url)
-        if response.status_code != 200:
-            self.logger.error(f"Failed to fetch page: {url} (Status Code: {response.status_code})")
-            return
+        response = self.fetch(url)
+        if response is None or response.status_code != 200:
+            self.logger.error(f"Failed to fetch page: {url} (Status Code: {status(response)})")
+            return []
 
-        soup = BeautifulSoup(response.text, "html.parser")
+        with instrument.span("scraper.parse"):
+            soup = BeautifulSoup(response.text, "html.parser")
         item_divs = soup.find_all("div", class_="w3-col m6 l3")
 
+        detail_urls = []
         for item in item_divs:
             link = item.find("a", href=True)
             if link:
-                detail_url = f"{self.base_url}/{link['href']}"
-                self.scrape_detail_page(detail_url)
+                detail_urls.append(f"{self.base_url}/{link['href']}")
+        return detail_urls
+
+    def scrape_page(self, page_number):
+        """
+        Scrape the main listing page for litematic links.
+        """
+        for detail_url in self.listing_links(page_number):
+            self.scrape_detail_page(detail_url)
 
+    @instrument.traced("scraper.detail_page")
     def scrape_detail_page(self, detail_url):
         """
         Scrape the detail page to find and download the litematic file.
         """
+        detail_id = detail_url.rstrip("/").split("/")[-1]
+        if detail_id in self.manifest.details:
+            self.logger.info(f"Detail page already scraped: {detail_url}")
+            return
+
         self.logger.info(f"Scraping detail page: {detail_url}")
 
-        response = self.session.get(detail_url)
-        if response.status_code != 200:
-            self.logger.error(f"Failed to fetch detail page: {detail_url} (Status Code: {response.status_code})")
+        response = self.fetch(detail_url)
+        if response is None or response.status_code != 200:
+            self.logger.error(f"Failed to fetch detail page: {detail_url} (Status Code: {status(response)})")
             return
 
-        soup = BeautifulSoup(response.text, "html.parser")
+        with instrument.span("scraper.parse"):
+            soup = BeautifulSoup(response.text, "html.parser")
         table = soup.find("table", class_="w3-table")
         if table:
             download_link = table.find("a", href=True, text="Download .Litematic")
             if download_link:
                 file_url = f"{self.base_url}/{download_link['href']}"
-                self.download_file(file_url)
+                if self.download_file(file_url):
+                    self.manifest.add({"detail": detail_id})
 
     def download_file(self, file_url):
         """
-        Download the litematic file and log it.
+        Download the litematic file and log it. Returns True if the file is (now) stored.
         """
         file_id = file_url.split("id=")[-1].split("&")[0]  # Extract unique ID from the URL
-        if file_id in self.visited_files:
-            self.logger.info(f"File already downloaded: {file_url}")
-            return
+        file_name = file_id + ".litematic"
+        # Claim the file before downloading so concurrent workers don't fetch it twice
+        with self.visited_lock:
+            if file_name in self.visited_files:
+                self.logger.info(f"File already downloaded: {file_url}")
+                return True
+            self.visited_files.add(file_name)
 
         self.logger.info(f"Downloading file: {file_url}")
 
-        response = self.session.get(file_url, stream=True)
-        if response.status_code == 200:
-            file_name = file_url.split("id=")[-1] + ".litematic"  # Create a file name from the URL
-            file_path = os.path.join(self.output_dir, file_name)
+        # fetch() retries failed responses; a download cut off mid-stream is fetched again here
+        for attempt in range(self.retries + 1):
+            if attempt:
+                instrument.count("scraper.retries")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            response = self.fetch(file_url, stream=True)
+            if response is None or response.status_code != 200:
+                error = f"Status Code: {status(response)}"
+                break
+            try:
+                file_path = self.store(response, file_name)
+            except (requests.RequestException, OSError) as e:
+                response.close()
+                error = e
+                self.logger.warning(
+                    f"Download interrupted: {file_url} ({e}) (attempt {attempt + 1}/{self.retries + 1})"
+                )
+                continue
+            self.logger.info(f"Downloaded: {file_path}")
+            return True
 
-            with open(file_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    file.write(chunk)
+        with self.visited_lock:
+            self.visited_files.discard(file_name)
+        self.logger.error(f"Failed to download file: {file_url} ({error})")
+        return False
 
-            self.visited_files.add(file_id)
-            self.logger.info(f"Downloaded: {file_path}")
-        else:
-            self.logger.error(f"Failed to download file: {file_url} (Status Code: {response.status_code})")
+    @instrument.traced("scraper.store")
+    def store(self, response, file_name):
+        """
+        Stream the response to a temp file with large buffers, hashing it on the way, then atomically
+        move it to <sha256><ext> in the output directory. Content that is already stored is dropped,
+        so the same build reached under different names is kept once. Returns the stored path.
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, prefix=f"{os.getpid()}-", suffix=PART_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb", buffering=CHUNK_SIZE) as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    file.write(chunk)
+                    instrument.count("scraper.bytes", len(chunk))
+                    digest.update(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+            sha256 = digest.hexdigest()
+            stored_name = sha256 + os.path.splitext(file_name)[1]
+            file_path = os.path.join(self.output_dir, stored_name)
+            if os.path.exists(file_path):
+                os.remove(tmp_path)
+                self.logger.info(f"Same content already stored: {file_name} -> {stored_name}")
+            else:
+                os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.manifest.add({"file": file_name, "sha256": sha256, "path": stored_name})
+        return file_path
 
-    def run(self, start_page=1, end_page=1):
+    def run(self, start_page=1, end_page=1, workers=1):
         """
         Start the scraping process from the given range of pages.
+        With workers > 1, detail pages and downloads are fetched concurrently, see run_concurrent().
         """
+        if workers > 1:
+            self.run_concurrent(start_page, end_page, workers)
+            return
         for page in range(start_page, end_page + 1):
             self.scrape_page(page)
 
+    def run_concurrent(self, start_page=1, end_page=1, workers=8):
+        """
+        Producer/consumer crawl: this thread walks the listing pages and queues detail URLs,
+        while a pool of `workers` threads fetches the detail pages and downloads.
+        """
+        detail_urls = queue.Queue(maxsize=workers * 4)
+
+        def consume():
+            while True:
+                detail_url = detail_urls.get()
+                if detail_url is None:
+                    return
+                try:
+                    self.scrape_detail_page(detail_url)
+                except Exception as e:
+                    self.logger.error(f"Error scraping {detail_url}: {e}")
+
+        threads = [threading.Thread(target=consume, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for page in range(start_page, end_page + 1):
+            for detail_url in self.listing_links(page):
+                detail_urls.put(detail_url)
+        for _ in threads:
+            detail_urls.put(None)
+        for thread in threads:
+            thread.join()
+
 
 # Example usage:
 if __name__ == "__main__":
     scraper = AbfielderScraper(
         base_url="https://abfielder.com/browse",
-        output_dir="litematic_files"
+        output_dir="litematic_files",
+        requests_per_second=4,
     )
-    scraper.run(start_page=1, end_page=2)  # Scrape pages 1 to 2
\ No newline at end of file
+    scraper.run(start_page=1, end_page=2, workers=8)  # Scrape pages 1 to 2
\ No newline at end of file
@@ -0,0 +1,140 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "utils"))  # instrument.py
+import instrument
+from LitematicaBuilder import LitematicaBuilder
+
+
+class ShelfPacker:
+    def __init__(self, row_width, gap):
+        """
+        Packs footprints left to right in rows (shelves) of at most row_width blocks,
+        starting a new row behind the deepest footprint of the current one when the next doesn't fit.
+
+        Args:
+            row_width (int): Maximum extent of a row along X.
+            gap (int): Empty blocks left between neighbouring footprints.
+        """
+        self.row_width = row_width
+        self.gap = gap
+        self.x = 0
+        self.z = 0
+        self.row_depth = 0
+
+    def place(self, width, length):
+        """
+        Reserves a width x length footprint.
+
+        Returns:
+            tuple: (x, z) offset of the footprint's corner.
+        """
+        if self.x > 0 and self.x + width > self.row_width:
+            self.x = 0
+            self.z += self.row_depth + self.gap
+            self.row_depth = 0
+        position = (self.x, self.z)
+        self.x += width + self.gap
+        self.row_depth = max(self.row_depth, length)
+        return position
+
+
+class BatchLitematicaBuilder:
+    def __init__(self, minecraft_world_path, litematic_paths, start=(0, -60, 0), row_width=512, gap=4,
+                 checkpoint_every=0, cache_dir="/tmp/amulet_cache"):
+        """
+        Pastes many Litematica files into one Minecraft world, loading and saving the world once.
+
+        Args:
+            minecraft_world_path (str): Path to the Minecraft world save.
+            litematic_paths (str or list): Directory of .litematic files, or a list of paths.
+            start (tuple): (x, y, z) of the corner of the first footprint.
+            row_width (int): Maximum extent of a row of builds along X.
+            gap (int): Empty blocks left between neighbouring builds.
+            checkpoint_every (int): Save the world after every this many builds (0 to only save at the end).
+            cache_dir (str): Path to the cache directory for Amulet (optional).
+        """
+        if isinstance(litematic_paths, str):
+            litematic_paths = sorted(
+                os.path.join(litematic_paths, name)
+                for name in os.listdir(litematic_paths)
+                if name.endswith(".litematic")
+            )
+        self.litematic_paths = list(litematic_paths)
+        self.start = start
+        self.packer = ShelfPacker(row_width, gap)
+        self.checkpoint_every = checkpoint_every
+        self.builder = LitematicaBuilder(minecraft_world_path, None, cache_dir)
+        self.placements = []
+        self.failures = []
+
+    def build(self):
+        """
+        Places every schematic at its own footprint and saves the world once at the end.
+        Schematics that fail to load or place are reported, kept in self.failures as (path, error) and skipped.
+
+        Returns:
+            list: (path, x, y, z, width, height, length) for each placed schematic.
+        """
+        builder = self.builder
+        builder.load_world()
+        start_x, start_y, start_z = self.start
+        total = len(self.litematic_paths)
+        t_start = time.perf_counter()
+
+        for i, path in enumerate(self.litematic_paths, 1):
+            builder.litematic_file_path = path
+            try:
+                builder.load_schematic()
+            except Exception as e:
+                print(f"[{i}/{total}] Error loading {path}: {e}")
+                self.failures.append((path, e))
+                continue
+
+            region = builder.region
+            width, height, length = abs(region.width), abs(region.height), abs(region.length)
+            offset_x, offset_z = self.packer.place(width, length)
+            x, y, z = start_x + offset_x, start_y, start_z + offset_z
+
+            # place_blocks_bulk puts region coordinate range_x()[0] at start_x + min_x(), so shift by min_x()
+            try:
+                builder.place_blocks_bulk(x - region.min_x(), y - region.min_y(), z - region.min_z())
+            except Exception as e:
+                # the footprint stays reserved, so whatever was written before the error overlaps no other build
+                print(f"[{i}/{total}] Error placing {path}: {e}")
+                self.failures.append((path, e))
+            else:
+                self.placements.append((path, x, y, z, width, height, length))
+                elapsed = time.perf_counter() - t_start
+                print(f"[{i}/{total}] {os.path.basename(path)} at ({x}, {y}, {z}), {elapsed:.1f} s elapsed")
+
+            if self.checkpoint_every and i % self.checkpoint_every == 0 and i < total:
+                print("Checkpoint: saving world...")
+                builder.world.save()
+
+        if self.failures:
+            print(f"{len(self.failures)} of {total} schematics failed: {', '.join(os.path.basename(p) for p, _ in self.failures)}")
+        builder.save_world()
+        return self.placements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paste a directory of .litematic files into one world")
+    parser.add_argument("world", help="path to the Minecraft world save")
+    parser.add_argument("litematics", nargs="+", help="a directory of .litematic files, or the files themselves")
+    parser.add_argument("--start", type=int, nargs=3, default=[0, -60, 0], metavar=("X", "Y", "Z"))
+    parser.add_argument("--row-width", type=int, default=512, help="maximum extent of a row of builds along X")
+    parser.add_argument("--gap", type=int, default=4, help="empty blocks between builds")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="save the world every N builds")
+    parser.add_argument("--trace", help="record stage timings, print a summary and write a Chrome trace here")
+    args = parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+
+    paths = args.litematics[0] if len(args.litematics) == 1 and os.path.isdir(args.litematics[0]) else args.litematics
+    BatchLitematicaBuilder(
+        args.world, paths, tuple(args.start), args.row_width, args.gap, args.checkpoint_every
+    ).build()
@@ -1,6 +1,12 @@
 from amulet.level import load_level
 from amulet.api.block import Block
+from amulet.api.errors import ChunkDoesNotExist
 import litemapy
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent / "utils"))  # instrument.py
+import instrument
+import numpy as np
 import os
 
 
@@ -24,6 +30,7 @@ class LitematicaBuilder:
         self.region = None
         self.game_version = None
 
+    @instrument.traced("builder.load_world")
     def load_world(self):
         """Loads the Minecraft world using Amulet."""
         print("Loading Minecraft world...")
@@ -31,10 +38,12 @@ class LitematicaBuilder:
         self.game_version = ("java", (1, 20, 5)) # (self.world.level_wrapper.platform, self.world.level_wrapper.version)
         print("Game version:", self.game_version)
 
+    @instrument.traced("builder.load_schematic")
     def load_schematic(self):
         """Loads the Litematica schematic."""
         print(f"Loading schematic: {self.litematic_file_path}")
         self.schematic = litemapy.Schematic.load(self.litematic_file_path)
+        instrument.count("builder.bytes_read", os.path.getsize(self.litematic_file_path))
 
         # Get the first region from the schematic
         self.region = list(self.schematic.regions.values())[0]
@@ -53,6 +62,7 @@ class LitematicaBuilder:
         if block and block_id != "minecraft:air":
             self.world.set_version_block(b_x, b_y, b_z, "minecraft:overworld", self.game_version, block)
 
+    @instrument.traced("builder.place_blocks")
     def place_blocks(self, start_x, start_y, start_z):
         """
         Places the blocks from the schematic into the Minecraft world.
@@ -72,8 +82,122 @@ class LitematicaBuilder:
                     new_block = Block(platform, blockname)
                     self.place_block(start_x + x, start_y + y, start_z + z, block_state_id, new_block)
 
+    def region_arrays(self):
+        """
+        Returns the region's palette and its block index array.
 
+        Returns:
+            tuple: (palette, blocks) where palette is a tuple of litemapy BlockStates and
+                blocks is an (X, Y, Z) integer array of palette indices. blocks[i, j, k] is
+                the block at (range_x()[i], range_y()[j], range_z()[k]).
+        """
+        palette = self.region.palette
+        # litemapy has no public accessor for the index array behind region[x, y, z]
+        blocks = self.region._Region__blocks
+        return palette, blocks
 
+    @instrument.traced("builder.place_blocks_bulk")
+    def place_blocks_bulk(self, start_x, start_y, start_z):
+        """
+        Places the blocks from the schematic into the Minecraft world, like place_blocks,
+        but translates each palette entry once and writes whole sub-chunks with NumPy
+        instead of calling set_version_block for every voxel.
+
+        Args:
+            start_x (int): X-coordinate to start placing the schematic.
+            start_y (int): Y-coordinate to start placing the schematic.
+            start_z (int): Z-coordinate to start placing the schematic.
+        """
+        print("Placing blocks into world (bulk)...")
+        palette, blocks = self.region_arrays()
+        block_ids = [block.id for block in palette]
+        air = np.array([block_id == "minecraft:air" for block_id in block_ids])
+
+        xs, ys, zs = np.nonzero(~air[blocks])
+        values = blocks[xs, ys, zs]
+        self.write_blocks(
+            xs + start_x + self.region.min_x(),
+            ys + start_y + self.region.min_y(),
+            zs + start_z + self.region.min_z(),
+            values,
+            block_ids,
+        )
+
+    @instrument.traced("builder.place_sparse")
+    def place_sparse(self, voxels, start_x, start_y, start_z, palette=None):
+        """
+        Places a sparse voxel grid (e.g. mcvis sparse.SparseVoxels) without visiting empty cells.
+
+        Args:
+            voxels: Object with .minecraft_coords() ((n, 3) indices in Minecraft's x, y, z order,
+                y up), .values ((n,) labels) and .palette (block id per label, label 0 being air, or None).
+                A SparseVoxels grid is z-up, so it is placed upright, as sendit.places does.
+            start_x (int): X-coordinate of the grid's origin.
+            start_y (int): Y-coordinate of the grid's origin.
+            start_z (int): Z-coordinate of the grid's origin.
+            palette (list): Block id per label, used instead of voxels.palette. Tuple entries
+                (random picks, as for sendit.places) have to be drawn first, see SparseVoxels.resolve().
+        """
+        palette = voxels.palette if palette is None else palette
+        if palette is None:
+            raise ValueError("place_sparse needs a palette: pass one or set voxels.palette")
+        palette = list(palette)
+        if any(isinstance(block_id, tuple) for block_id in palette):
+            raise ValueError("palette has tuple entries (random picks), draw them first with voxels.resolve(seed=...)")
+
+        print("Placing sparse voxels into world...")
+        air = np.array([block_id == "minecraft:air" for block_id in palette])
+        solid = ~air[voxels.values]
+        xs, ys, zs = voxels.minecraft_coords()[solid].T
+        self.write_blocks(xs + start_x, ys + start_y, zs + start_z, voxels.values[solid], palette)
+
+    @instrument.traced("builder.write_blocks")
+    def write_blocks(self, xs, ys, zs, values, block_ids):
+        """
+        Writes blocks at world coordinates, whole sub-chunks at a time.
+
+        Args:
+            xs, ys, zs (np.ndarray): World coordinates of the blocks.
+            values (np.ndarray): Index into block_ids of each block.
+            block_ids (list): Block ids such as "minecraft:stone".
+        """
+        dimension = "minecraft:overworld"
+
+        # One Block per palette entry, translated to amulet's universal format once
+        translator = self.world.translation_manager.get_version(*self.game_version).block
+        universal = []
+        for block_id in block_ids:
+            platform, blockname = block_id.split(":")
+            universal.append(translator.to_universal(Block(platform, blockname))[0])
+
+        # Group the blocks by (chunk x, chunk z, sub-chunk y)
+        cxs, cys, czs = xs >> 4, ys >> 4, zs >> 4
+        order = np.lexsort((cys, czs, cxs))
+        xs, ys, zs, cxs, cys, czs, values = (a[order] for a in (xs, ys, zs, cxs, cys, czs, values))
+        splits = np.flatnonzero((np.diff(cxs) != 0) | (np.diff(czs) != 0) | (np.diff(cys) != 0)) + 1
+
+        chunks = {}
+        for group in np.split(np.arange(len(values)), splits):
+            if len(group) == 0:
+                continue
+            cx, cy, cz = int(cxs[group[0]]), int(cys[group[0]]), int(czs[group[0]])
+            if (cx, cz) not in chunks:
+                try:
+                    chunk = self.world.get_chunk(cx, cz, dimension)
+                except ChunkDoesNotExist:
+                    chunk = self.world.create_chunk(cx, cz, dimension)
+                # schematic palette index -> this chunk's palette index
+                lookup = np.array([chunk.block_palette.get_add_block(block) for block in universal])
+                chunk.changed = True
+                chunks[(cx, cz)] = (chunk, lookup)
+            chunk, lookup = chunks[(cx, cz)]
+            section = chunk.blocks.get_sub_chunk(cy)
+            section[xs[group] - 16 * cx, ys[group] - 16 * cy, zs[group] - 16 * cz] = lookup[values[group]]
+        instrument.count("builder.blocks", len(values))
+        instrument.count("builder.chunks", len(chunks))
+        print(f"Placed {len(values)} blocks in {len(chunks)} chunks.")
+
+    @instrument.traced("builder.save_world")
     def save_world(self):
         """Saves and closes the Minecraft world."""
         if self.world:
@@ -94,5 +218,5 @@ if __name__ == "__main__":
     builder = LitematicaBuilder(MINECRAFT_WORLD_PATH, LITEMATIC_FILE_PATH)
     builder.load_world()
     builder.load_schematic()
-    builder.place_blocks(START_X, START_Y, START_Z)
+    builder.place_blocks_bulk(START_X, START_Y, START_Z)
     builder.save_world()
\ No newline at end of file
@@ -0,0 +1,81 @@
+import argparse
+import os
+import tempfile
+import time
+
+import litemapy
+import numpy as np
+from amulet.level.formats.anvil_world import AnvilFormat
+
+from LitematicaBuilder import LitematicaBuilder
+
+"""
+Times LitematicaBuilder.place_blocks against place_blocks_bulk on a synthetic litematic
+and checks that both put the same blocks into the world.
+
+python bench_litematica_builder.py --size 128
+"""
+
+BLOCKS = ["minecraft:stone", "minecraft:oak_planks", "minecraft:glass", "minecraft:cobblestone", "minecraft:oak_log"]
+
+
+def make_litematic(path, size, air=0.6, seed=0):
+    """Writes a size^3 litematic with random blocks, `air` of it left empty."""
+    rng = np.random.default_rng(seed)
+    region = litemapy.Region(0, 0, 0, size, size, size)
+    # one region[x, y, z] write per block type to add it to the palette, then fill the index array directly
+    for i, block_id in enumerate(BLOCKS):
+        region[i, 0, 0] = litemapy.BlockState(block_id)
+    blocks = rng.integers(1, len(BLOCKS) + 1, size=(size, size, size))
+    blocks[rng.random((size, size, size)) < air] = 0
+    region._Region__blocks[...] = blocks
+    region.as_schematic(name="bench").save(path)
+
+
+def make_world(path):
+    """Creates an empty Java world to place into."""
+    wrapper = AnvilFormat(path)
+    wrapper.create_and_open("java", (1, 20, 5), overwrite=True)
+    wrapper.close()
+
+
+def run(method, world_path, litematic_path, start):
+    builder = LitematicaBuilder(world_path, litematic_path)
+    builder.load_world()
+    builder.load_schematic()
+    t0 = time.perf_counter()
+    getattr(builder, method)(*start)
+    elapsed = time.perf_counter() - t0
+    return builder, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LitematicaBuilder placement")
+    parser.add_argument("--size", type=int, default=128, help="side length of the synthetic litematic")
+    parser.add_argument("--samples", type=int, default=2000, help="positions compared between the two worlds")
+    args = parser.parse_args()
+
+    start = (40, -60, 40)
+    with tempfile.TemporaryDirectory() as tmp:
+        litematic_path = os.path.join(tmp, "bench.litematic")
+        make_litematic(litematic_path, args.size)
+
+        builders = {}
+        for method in ("place_blocks", "place_blocks_bulk"):
+            world_path = os.path.join(tmp, method)
+            make_world(world_path)
+            builders[method], elapsed = run(method, world_path, litematic_path, start)
+            print(f"{method}: {args.size}^3 in {elapsed:.2f} s ({args.size ** 3 / elapsed:,.0f} voxels/s)")
+
+        rng = np.random.default_rng(1)
+        legacy, bulk = builders["place_blocks"].world, builders["place_blocks_bulk"].world
+        for x, y, z in rng.integers(0, args.size, size=(args.samples, 3)).tolist():
+            position = (start[0] + x, start[1] + y, start[2] + z, "minecraft:overworld")
+            assert legacy.get_block(*position) == bulk.get_block(*position), f"blocks differ at {position}"
+        print(f"{args.samples} sampled positions match")
+        for builder in builders.values():
+            builder.world.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,42 @@
 import lib.grabcraft_to_schema as gts
 import lib.blockmodel_avg_mapper as bam
+import block_index
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[2] / "utils"))  # instrument.py
+import instrument
 import json
 import PIL
 from PIL import Image
 import numpy as np
-from pathlib import Path
 import argparse
 import hashlib
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, ProcessPoolExecutor, wait
 from tqdm import tqdm
 
 '''
 Script to automatically download image schematics from grabcraft given a list of urls
 --urls: file with urls of the Grabcraft models, see data/houses.txt
 --dir: directory to store the data, default is 'dataset'
+--jobs: download with this many threads and render/crop/save with this many processes
+
+Finished builds are recorded in <dir>/manifest.jsonl keyed on the URL hash, so re-running
+over the same url list skips them before downloading anything.
 
 Edit 2/25/25: Thanks Xiuyuan!
 '''
 
-# Load the block map
-gts.load_block_map("data/blockmap.csv")
+# Load the block map (from its pickle when the csv hasn't changed) and memoize auto_block_map
+block_index.load_block_map(gts, "data/blockmap.csv")
+block_index.BlockIndex.load().install(gts)
+
+MANIFEST = "manifest.jsonl"
+# layers are written to a <build dir name>.<random><TMP_SUFFIX> folder, renamed into place once all are saved
+TMP_SUFFIX = ".tmp"
 
 def batch_save(urls):
     for url in urls:
@@ -27,27 +45,157 @@ def batch_save(urls):
 def hash_str(s):
     return str(hashlib.md5(s.encode()).hexdigest())
 
-def get_and_save_slices(url, save_dir, pfunc=print):
-    schem = gts.url_to_render_object_data(url)
-    url_hash = hash_str(url)[1:5] # to avoid name collisions
-    pfunc(f"Done downloading")
+def load_manifest(save_dir):
+    '''url hash -> build directory name, for every build finished by a previous run'''
+    path = Path(save_dir) / MANIFEST
+    done = {}
+    if path.exists():
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a torn last line from an interrupted run
+                done[record["hash"]] = record["dir"]
+    return done
 
-    img, name, dims = gts.render_object_to_png_slice(schem, with_metadata=True)
+def record_done(save_dir, url, build_dir):
+    with open(Path(save_dir) / MANIFEST, "a") as f:
+        f.write(json.dumps({"url": url, "hash": hash_str(url), "dir": Path(build_dir).name}) + "\n")
+
+def download(url):
+    '''returns (render object, {"download": seconds})'''
+    t0 = time.perf_counter()
+    with instrument.span("auto_down.download", url=url):
+        schem = gts.url_to_render_object_data(url)
+    instrument.count("auto_down.downloads")
+    return schem, {"download": time.perf_counter() - t0}
+
+def render_and_save(schem, url, save_dir):
+    '''
+    renders a downloaded build and writes one PNG per layer to <save_dir>/<name>_<hash>
+    returns (build directory, layers written, {"render": seconds, "save": seconds})
+    '''
+    timings = {}
+    t0 = time.perf_counter()
+    url_hash = hash_str(url)[1:5] # to avoid name collisions
+    with instrument.span("auto_down.render"):
+        img, name, dims = gts.render_object_to_png_slice(schem, with_metadata=True)
     name = name.replace(" ", "_")
     width, height, length = dims
-    save_dir = save_dir + "/" + name + "_" + url_hash
-    Path(save_dir).mkdir(parents=True, exist_ok=True)
+    timings["render"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    build_dir = Path(save_dir) / (name + "_" + url_hash)
+
+    # every layer already there (written by a run from before the manifest)
+    if build_dir.exists():
+        if len(list(build_dir.glob("*.png"))) == length:
+            return str(build_dir), 0, timings
+        shutil.rmtree(build_dir)
+
+    # a run killed mid-write leaves a .tmp folder behind (cleared by run()), never a partial build
+    tmp_dir = Path(tempfile.mkdtemp(dir=save_dir, prefix=build_dir.name + ".", suffix=TMP_SUFFIX))
+    try:
+        with instrument.span("auto_down.save", layers=length):
+            for i in range(length):
+                # crop pil image (left, up, right, down)
+                left_border, right_border = i * width, (i + 1) * width
+                img.crop((left_border, 0, right_border, height)).save(tmp_dir / f"{name}_{i}.png")
+        tmp_dir.replace(build_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    instrument.count("auto_down.layers", length)
+    instrument.count("auto_down.blocks", width * height * length)
+    timings["save"] = time.perf_counter() - t0
+    return str(build_dir), length, timings
 
-    # check if directory is empty 
-    if any(Path(save_dir).iterdir()):
-        pfunc(f"Directory {save_dir} is already populated, skipping...")
-        return
+def render_and_save_worker(schem, url, save_dir):
+    '''render_and_save in a worker process (started with instrument.reset), also handing back what it recorded'''
+    return render_and_save(schem, url, save_dir), instrument.drain()
 
-    for i in range(length):
-        # crop pil image (left, up, right, down)
-        left_border, right_border = i * width, (i + 1) * width
-        img.crop((left_border, 0, right_border, height)).save(f"{save_dir}/{name}_{i}.png")
-    pfunc(f"Done writing {length} ims for {name}.")
+def get_and_save_slices(url, save_dir, pfunc=print):
+    schem, timings = download(url)
+    pfunc(f"Done downloading")
+
+    build_dir, length, render_timings = render_and_save(schem, url, save_dir)
+    timings.update(render_timings)
+    if length == 0:
+        pfunc(f"Directory {build_dir} is already populated, skipping...")
+    else:
+        pfunc(f"Done writing {length} ims for {Path(build_dir).name}.")
+    return build_dir, timings
+
+def print_timings(totals, counts, wall):
+    '''per-stage summary: builds, summed seconds and mean seconds per build'''
+    print(f"{'stage':<10}{'builds':>8}{'total s':>10}{'mean s':>10}")
+    for stage in ("download", "render", "save"):
+        if counts[stage]:
+            print(f"{stage:<10}{counts[stage]:>8}{totals[stage]:>10.2f}{totals[stage] / counts[stage]:>10.3f}")
+    print(f"{'wall':<10}{'':>8}{wall:>10.2f}")
+
+def run(urls, save_dir, jobs=1):
+    '''downloads and slices every url not in the manifest, then prints per-stage timings'''
+    t_start = time.perf_counter()
+    for tmp_dir in Path(save_dir).glob("*" + TMP_SUFFIX):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    done = load_manifest(save_dir)
+    todo = [url for url in urls if hash_str(url) not in done]
+    print(f"{len(urls) - len(todo)} of {len(urls)} builds already done, skipping them")
+
+    totals, counts = defaultdict(float), defaultdict(int)
+    def add(timings):
+        for stage, seconds in timings.items():
+            totals[stage] += seconds
+            counts[stage] += 1
+
+    pbar = tqdm(total=len(todo))
+    if jobs <= 1:
+        for url in todo:
+            try:
+                build_dir, timings = get_and_save_slices(url, save_dir, pbar.set_description)
+                record_done(save_dir, url, build_dir)
+                add(timings)
+            except Exception as e:
+                print(f"Error with {url}: {e}")
+            pbar.update()
+    else:
+        # downloads are network-bound, rendering and PNG encoding are CPU-bound
+        with ThreadPoolExecutor(jobs) as downloads, ProcessPoolExecutor(jobs, initializer=instrument.reset) as renders:
+            # one loop over both pools, so each build is recorded in the manifest as soon as it is
+            # saved rather than after every download has finished. At most 2 * jobs builds are in
+            # flight, so downloaded render objects don't pile up in front of the render processes
+            queued = iter(todo)
+            pending = {}
+            def top_up():
+                while len(pending) < 2 * jobs:
+                    url = next(queued, None)
+                    if url is None:
+                        return
+                    pending[downloads.submit(download, url)] = ("download", url)
+            top_up()
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, url = pending.pop(future)
+                    try:
+                        if stage == "download":
+                            schem, timings = future.result()
+                            add(timings)
+                            pending[renders.submit(render_and_save_worker, schem, url, save_dir)] = ("render", url)
+                            continue
+                        (build_dir, length, timings), recorded = future.result()
+                        instrument.merge(recorded)
+                        record_done(save_dir, url, build_dir)
+                        add(timings)
+                        pbar.set_description(f"Done writing {length} ims for {Path(build_dir).name}.")
+                    except Exception as e:
+                        print(f"Error with {url}: {e}")
+                    pbar.update()
+                top_up()
+    pbar.close()
+    print_timings(totals, counts, time.perf_counter() - t_start)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -56,16 +204,15 @@ if __name__ == "__main__":
                     epilog='Text at the bottom of help')
     parser.add_argument('-u', '--urls', help='file with urls of the Grabcraft models', required=True)
     parser.add_argument('-d', '--dir', help='directory to store the data', default='dataset')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='download threads and render processes')
+    parser.add_argument('--trace', help='record stage timings, print a summary and write a Chrome trace here')
     args = parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
 
     if not Path(args.dir).exists():
         Path(args.dir).mkdir(parents=True, exist_ok=True)
 
     with open(args.urls, 'r') as f:
-        urls = f.readlines()
-        pbar = tqdm(urls)
-        for url in pbar:
-            try:
-                get_and_save_slices(url.strip(), args.dir, pbar.set_description)
-            except Exception as e:
-                print(f"Error with {url}: {e}")
+        urls = [url.strip() for url in f if url.strip()]
+    run(urls, args.dir, args.jobs)
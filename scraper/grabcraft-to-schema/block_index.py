@@ -0,0 +1,168 @@
+import csv
+import json
+import os
+import pickle
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+'''
+Compiled GrabCraft block name -> Minecraft block state index
+
+The blockmap CSVs are parsed once and pickled next to them; the pickle is rebuilt whenever a CSV
+is newer than it. Target block states are interned to integer ids (0 is minecraft:air), so a
+render object maps to an int volume in one call:
+
+    index = BlockIndex.load()
+    volume = index.render_object_ids(schem)     # (x, y, z) ids into index.names
+
+Names in neither CSV go through auto_block_map once each; the results are memoized and the names
+counted in index.misses, which save_misses() writes out as candidates for blockmap.csv.
+'''
+
+DATA_DIR = Path(__file__).parent / "data"
+# earlier files win, blockmap.csv is the cleaned-up raw-blockmap.csv
+BLOCKMAPS = (DATA_DIR / "blockmap.csv", DATA_DIR / "raw-blockmap.csv")
+CACHE = DATA_DIR / "blockmap.index.pkl"
+AIR = "minecraft:air"
+
+
+def state_string(target, states):
+    '''minecraft:anvil + [facing, east] -> minecraft:anvil[facing=east]'''
+    pairs = [(k, v) for k, v in zip(states[::2], states[1::2]) if k]
+    if not pairs:
+        return target
+    return target + "[" + ",".join(f"{k}={v}" for k, v in pairs) + "]"
+
+
+def parse_blockmap(path):
+    '''grabcraft name -> block state from a blockmap CSV (blockmap.csv has an extra index column and a header)'''
+    table = {}
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    if rows and rows[0][1:3] == ["from", "to"]:
+        rows = [row[1:] for row in rows[1:]]
+    for row in rows:
+        if len(row) < 2 or not row[0] or not row[1]:
+            continue
+        table.setdefault(row[0].strip(), state_string(row[1], row[2:]))
+    return table
+
+
+def load_block_map(gts, path="data/blockmap.csv", cache_path=None):
+    '''
+    gts.load_block_map(path), except that the resulting gts.block_map is pickled and reused on the
+    next start until the CSV changes
+    '''
+    cache_path = Path(cache_path or str(path) + ".pkl")
+    if cache_path.exists() and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        with open(cache_path, "rb") as f:
+            gts.block_map = pickle.load(f)
+        return
+    gts.load_block_map(str(path))
+    write_atomic(cache_path, gts.block_map)
+
+
+def render_object_voxels(render_object, dims=None):
+    '''
+    the voxels of a RenderObject (or its .obj: the dict / JSON string keyed obj[y][x][z]) as (3, n)
+    0-based x, y, z, their n grabcraft names, and the (x, y, z) dims: the object's own, else the extent of its voxels
+    '''
+    obj = getattr(render_object, "obj", render_object)
+    if isinstance(obj, str):
+        obj = json.loads(obj)
+    voxels = [voxel for by_x in obj.values() for by_z in by_x.values() for voxel in by_z.values()]
+    # RenderObject coordinates are 1-based
+    xyz = np.array([[int(v["x"]), int(v["y"]), int(v["z"])] for v in voxels]).T - 1
+    if dims is None:
+        dims = getattr(render_object, "dims", None) or tuple(xyz.max(axis=1) + 1)
+    return xyz, [v["name"] for v in voxels], dims
+
+
+def write_atomic(path, obj):
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+class BlockIndex:
+    def __init__(self, table, auto_map=None):
+        '''
+        table: grabcraft name -> block state
+        auto_map: fallback for names not in table, default lib.grabcraft_to_schema.auto_block_map
+        '''
+        self.names = [AIR]
+        self.ids = {AIR: 0}
+        self.table = {name: self.intern(target) for name, target in table.items()}
+        self.auto_map = auto_map
+        self.memo = {}
+        self.misses = Counter()
+
+    @classmethod
+    def load(cls, paths=BLOCKMAPS, cache_path=CACHE, auto_map=None):
+        '''parses the CSVs, or reads the pickled table if it is newer than all of them'''
+        paths = [Path(p) for p in paths if Path(p).exists()]
+        newest = max(os.path.getmtime(p) for p in paths)
+        if cache_path and Path(cache_path).exists() and os.path.getmtime(cache_path) >= newest:
+            with open(cache_path, "rb") as f:
+                table = pickle.load(f)
+        else:
+            table = {}
+            for path in paths:
+                for name, target in parse_blockmap(path).items():
+                    table.setdefault(name, target)
+            if cache_path:
+                write_atomic(cache_path, table)
+        return cls(table, auto_map)
+
+    def intern(self, target):
+        if target not in self.ids:
+            self.ids[target] = len(self.names)
+            self.names.append(target)
+        return self.ids[target]
+
+    def id(self, name):
+        '''target id of a grabcraft name; unmapped names go through auto_map once'''
+        name = name.strip()
+        if name in self.table:
+            return self.table[name]
+        self.misses[name] += 1
+        if name not in self.memo:
+            if self.auto_map is None:
+                from lib.grabcraft_to_schema import auto_block_map
+                self.auto_map = auto_block_map
+            self.memo[name] = self.intern(self.auto_map(name))
+        return self.memo[name]
+
+    def target(self, name):
+        '''block state of a grabcraft name, a memoized drop-in for gts.auto_block_map'''
+        return self.names[self.id(name)]
+
+    def map_names(self, names):
+        '''target ids for an array of grabcraft names, looking each distinct name up once'''
+        unique, inverse = np.unique(np.asarray(names), return_inverse=True)
+        lookup = np.array([self.id(name) for name in unique.tolist()], dtype=np.int32)
+        return lookup[inverse.ravel()].reshape(np.shape(names))
+
+    def render_object_ids(self, render_object, dims=None):
+        '''(x, y, z) int32 target ids of a RenderObject (or its .obj dict / JSON string), air where it has no voxel'''
+        xyz, names, dims = render_object_voxels(render_object, dims)
+        volume = np.zeros(dims, dtype=np.int32)
+        volume[tuple(xyz)] = self.map_names(names)
+        return volume
+
+    def install(self, gts):
+        '''routes the library's auto_block_map through this index, so repeated names are mapped once'''
+        if self.auto_map is None:
+            self.auto_map = gts.auto_block_map
+        gts.auto_block_map = self.target
+
+    def save_misses(self, path):
+        '''name, times seen, auto-mapped block state for every name not in the CSVs, most frequent first'''
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["from", "count", "auto"])
+            for name, count in self.misses.most_common():
+                writer.writerow([name, count, self.names[self.memo[name]]])
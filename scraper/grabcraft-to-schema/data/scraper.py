@@ -1,32 +1,146 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from bs4 import BeautifulSoup
 """
 get urls from grabcraft and save to file
 
+Listing pages are fetched a sliding window at a time over one pooled session, and only URLs
+missing from the output file are appended. With --incremental, the crawl stops at the first
+URL already in the file, since the listing is sorted by date.
+
+python scraper.py --out houses.txt --incremental
+
 Edit 2/25/25: Thanks Xiuyuan!
 """
 HDR = {'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/42.0.2311.135 Safari/537.36 Edge/12.246"}
+BASE_URL = "https://www.grabcraft.com"
+LISTING = "/minecraft/houses/sort/date1/pg/{pg}"
+
+
+def make_session(pool_size=8):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HDR)
+    return session
 
-def read_page(url):
-    r = requests.get(url=url, headers=HDR)
-    soup = BeautifulSoup(r.content,  "html.parser") 
-    n_table = soup.findAll('h3', attrs = {'class':'name'}) 
+
+class HarvestError(Exception):
+    def __init__(self, page, new):
+        """A listing page still failed after its retries; new holds the URLs harvested before it."""
+        super().__init__(f"listing page {page} failed")
+        self.page = page
+        self.new = new
+
+
+def read_page(url, session=None, retries=3, backoff=1.0):
+    """
+    The house URLs on a listing page. Non-200 responses (e.g. 429/503 when throttled) and connection
+    errors are retried with exponential backoff, or after Retry-After when given; then the last one is
+    raised, so a failed page is never mistaken for the empty page past the end of the listing.
+    """
+    for attempt in range(retries + 1):
+        try:
+            r = (session or requests).get(url=url, headers=HDR)
+            r.raise_for_status()
+            break
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise
+            retry_after = getattr(e.response, "headers", {}).get("Retry-After", "")
+            time.sleep(float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt)
+    soup = BeautifulSoup(r.content,  "html.parser")
+    n_table = soup.findAll('h3', attrs = {'class':'name'})
 
     urls = []
     for row in n_table:
         urls.append(row.find('a')['href'])
     return urls
 
-pg = 1
-prev_result = True
-cumulative = []
-while prev_result:
-    urls = read_page(f"https://www.grabcraft.com/minecraft/houses/sort/date1/pg/{pg}")
-    prev_result = urls
-    cumulative += urls
-    print(f"\rpage: {pg}, {len(urls)} urls found, {len(cumulative)} total")
-    pg += 1
-
-with open('houses.txt', 'w') as f:
-    for line in cumulative:
-        f.write(f"https://www.grabcraft.com{line}\n")
\ No newline at end of file
+
+def harvest(base_url=BASE_URL, known=(), window=8, incremental=False, retries=3, backoff=1.0):
+    """
+    Crawl the listing pages in order, keeping `window` page requests in flight, until a page comes back empty.
+    - known: URLs already harvested; they are never returned again
+    - incremental: also stop at the first known URL
+    - retries, backoff: per page, see read_page()
+    returns the new URLs in listing order; raises HarvestError, holding the ones found so far, if a page fails
+    """
+    known = set(known)
+    session = make_session(window)
+    new = []
+    with ThreadPoolExecutor(window) as pool:
+        def submit(pg):
+            return pg, pool.submit(read_page, base_url + LISTING.format(pg=pg), session, retries, backoff)
+
+        pending = deque(submit(pg) for pg in range(1, window + 1))
+        next_pg = window + 1
+        while pending:
+            pg, future = pending.popleft()
+            try:
+                urls = [base_url + url for url in future.result()]
+            except requests.RequestException as e:
+                for _, future in pending:
+                    future.cancel()
+                raise HarvestError(pg, new) from e
+            if not urls:
+                break
+
+            reached_known = False
+            for url in urls:
+                if url in known:
+                    reached_known = incremental
+                    if reached_known:
+                        break
+                    continue
+                known.add(url)
+                new.append(url)
+            print(f"\rpage: {pg}, {len(urls)} urls found, {len(new)} new")
+            if reached_known:
+                break
+
+            pending.append(submit(next_pg))
+            next_pg += 1
+
+        for _, future in pending:
+            future.cancel()
+    return new
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest GrabCraft house URLs")
+    parser.add_argument("-o", "--out", default="houses.txt", help="URL list to append new URLs to")
+    parser.add_argument("-w", "--window", type=int, default=8, help="listing pages fetched concurrently")
+    parser.add_argument("-i", "--incremental", action="store_true", help="stop at the first URL already in --out")
+    parser.add_argument("--base-url", default=BASE_URL)
+    args = parser.parse_args()
+
+    existing = []
+    if os.path.exists(args.out):
+        with open(args.out) as f:
+            text = f.read()
+        existing = [line.strip() for line in text.splitlines() if line.strip()]
+
+    failed = None
+    try:
+        new = harvest(args.base_url, existing, args.window, args.incremental)
+    except HarvestError as e:
+        # keep what was harvested before the failed page
+        new, failed = e.new, e
+    with open(args.out, 'a') as f:
+        if existing and not text.endswith("\n"):
+            f.write("\n")
+        for line in new:
+            f.write(f"{line}\n")
+    print(f"{len(new)} new urls appended to {args.out}, {len(existing) + len(new)} total")
+    if failed:
+        # an --incremental run would stop at the URLs just appended and never reach the pages after the failure
+        print(f"Stopped early, {failed} ({failed.__cause__}); run again without --incremental to get the rest")
+        sys.exit(1)
@@ -0,0 +1,102 @@
+import re
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import scraper
+
+"""
+harvest() against a local stand-in for the GrabCraft listing: paged HTML in the same markup
+read_page() parses, with the earlier pages answered slowest so that concurrent requests finish
+out of order, and pages that answer 503 a given number of times before they come through.
+
+python -m unittest test_scraper     (from this directory)
+"""
+
+PER_PAGE = 4
+# pages 1-5 hold builds, 6 is empty, 7 holds builds again that must never be reached
+FULL_PAGES = [1, 2, 3, 4, 5, 7]
+
+
+def page_urls(pg):
+    return [f"/minecraft/house-{pg}-{i}" for i in range(PER_PAGE)] if pg in FULL_PAGES else []
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = re.fullmatch(r"/minecraft/houses/sort/date1/pg/(\d+)", self.path)
+        if not match:
+            self.send_error(404)
+            return
+        pg = int(match.group(1))
+        with self.server.lock:
+            throttled = self.server.failures.get(pg, 0) > 0
+            if throttled:
+                self.server.failures[pg] -= 1
+        if throttled:
+            self.send_error(503)
+            return
+        time.sleep(max(0, 6 - pg) * 0.02)
+        items = "".join(f'<h3 class="name"><a href="{url}">{url}</a></h3>' for url in page_urls(pg))
+        body = f"<html><body>{items}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HarvestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ListingHandler)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        # listing page -> 503s it answers before the listing itself
+        self.server.failures = {}
+
+    def listing(self, pages):
+        return [self.base_url + url for pg in pages for url in page_urls(pg)]
+
+    def test_listing_order_and_stop_at_empty_page(self):
+        new = scraper.harvest(self.base_url, window=3)
+        self.assertEqual(new, self.listing([1, 2, 3, 4, 5]))
+
+    def test_known_urls_are_skipped(self):
+        known = self.listing([2])
+        new = scraper.harvest(self.base_url, known, window=4)
+        self.assertEqual(new, self.listing([1, 3, 4, 5]))
+
+    def test_incremental_stops_at_first_known_url(self):
+        known = [self.base_url + "/minecraft/house-3-2"]
+        new = scraper.harvest(self.base_url, known, window=8, incremental=True)
+        self.assertEqual(new, self.listing([1, 2]) + [self.base_url + "/minecraft/house-3-0",
+                                                      self.base_url + "/minecraft/house-3-1"])
+
+    def test_throttled_page_is_retried(self):
+        self.server.failures = {2: 2}
+        new = scraper.harvest(self.base_url, window=3, retries=2, backoff=0)
+        self.assertEqual(new, self.listing([1, 2, 3, 4, 5]))
+
+    def test_failed_page_is_not_the_end_of_the_listing(self):
+        self.server.failures = {3: 100}
+        with self.assertRaises(scraper.HarvestError) as caught:
+            scraper.harvest(self.base_url, window=3, retries=1, backoff=0)
+        self.assertEqual(caught.exception.page, 3)
+        self.assertEqual(caught.exception.new, self.listing([1, 2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import AbfielderScraper as abfielder
+except ImportError:  # cloudscraper missing
+    abfielder = None
+
+"""
+AbfielderScraper against a local stand-in for abfielder.com: listing pages, detail pages with the
+download table and the files themselves, where every path answers 503 the first time it is asked
+for and the paths in DEAD always do, while the ones in CUT_OFF break off halfway through the
+first download that gets through, so retries, resume and failed downloads can be checked
+without the real site.
+
+python -m unittest test_abfielder_scraper     (from this directory)
+"""
+
+# listing page -> detail ids on it
+PAGES = {1: [1, 2], 2: [3, 4]}
+# paths that never answer anything but 503
+DEAD = {"/browse/download?id=4"}
+# paths whose second answer (the first after the 503) is cut off mid-body
+CUT_OFF = {"/browse/download?id=2"}
+
+
+def content(detail_id):
+    return f"litematic {detail_id}\n".encode() * 1000
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits[self.path] += 1
+            first = self.server.hits[self.path] == 1
+            cut_off = self.path in CUT_OFF and self.server.hits[self.path] == 2
+        if first or self.path in DEAD:
+            self.send_error(503)
+            return
+
+        if match := re.fullmatch(r"/browse/tags/House/(\d+)/popular", self.path):
+            items = "".join(f'<div class="w3-col m6 l3"><a href="schematic/{i}">build {i}</a></div>'
+                            for i in PAGES.get(int(match.group(1)), []))
+            self.reply(f"<html><body>{items}</body></html>".encode())
+        elif match := re.fullmatch(r"/browse/schematic/(\d+)", self.path):
+            table = f'<table class="w3-table"><tr><td><a href="download?id={match.group(1)}">Download .Litematic</a></td></tr></table>'
+            self.reply(f"<html><body>{table}</body></html>".encode())
+        elif match := re.fullmatch(r"/browse/download\?id=(\d+)", self.path):
+            self.reply(content(int(match.group(1))), "application/octet-stream", cut_off)
+        else:
+            self.send_error(404)
+
+    def reply(self, body, content_type="text/html", cut_off=False):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if cut_off:
+            # hang up before the promised length, the client sees a broken stream
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(abfielder is None, "needs cloudscraper")
+class FlakySiteTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+        self.server.hits = Counter()
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/browse"
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.output_dir.cleanup()
+
+    def scrape(self, workers):
+        scraper = abfielder.AbfielderScraper(self.base_url, self.output_dir.name, log_file=os.devnull,
+                                             retries=2, backoff=0)
+        scraper.run(start_page=1, end_page=2, workers=workers)
+        return scraper
+
+    def check_stored(self):
+        stored = sorted(name for name in os.listdir(self.output_dir.name) if name != "manifest.jsonl")
+        expected = sorted(hashlib.sha256(content(i)).hexdigest() + ".litematic" for i in (1, 2, 3))
+        self.assertEqual(stored, expected)
+        for i in (1, 2, 3):
+            path = os.path.join(self.output_dir.name, hashlib.sha256(content(i)).hexdigest() + ".litematic")
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), content(i))
+        with open(os.path.join(self.output_dir.name, "manifest.jsonl")) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(sorted(r["detail"] for r in records if "detail" in r), ["1", "2", "3"])
+        self.assertEqual(sorted(r["file"] for r in records if "file" in r),
+                         ["1.litematic", "2.litematic", "3.litematic"])
+
+    def test_retries_past_503s(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                self.server.hits.clear()
+                self.scrape(workers)
+                self.check_stored()
+                # every build is fetched again after its 503 and never a third time, except
+                # after a cut-off download; the dead download is given up after the retries
+                for path, hits in self.server.hits.items():
+                    self.assertEqual(hits, 3 if path in DEAD | CUT_OFF else 2, path)
+                self.assertIn("/browse/download?id=4", self.server.hits)
+                # clear the stored files and manifest for the next round
+                for name in os.listdir(self.output_dir.name):
+                    os.remove(os.path.join(self.output_dir.name, name))
+
+    def test_resume_skips_finished_builds(self):
+        self.scrape(workers=4)
+        self.server.hits.clear()
+        self.scrape(workers=4)
+        self.check_stored()
+        # only the listing pages and the build that never downloaded are asked for again
+        fetched = {path for path in self.server.hits if "/tags/" not in path}
+        self.assertEqual(fetched, {"/browse/schematic/4", "/browse/download?id=4"})
+
+    def test_only_abandoned_parts_are_removed(self):
+        running = f"{os.getppid()}-inflight{abfielder.PART_SUFFIX}"
+        abandoned = [f"999999999-dead{abfielder.PART_SUFFIX}", f"legacy{abfielder.PART_SUFFIX}"]
+        for name in [running] + abandoned:
+            open(os.path.join(self.output_dir.name, name), "wb").close()
+        self.scrape(workers=4)
+        self.assertIn(running, os.listdir(self.output_dir.name))
+        for name in abandoned:
+            self.assertNotIn(name, os.listdir(self.output_dir.name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+"""
+The batch side of the *_to_block.py readers: find the files, convert them with a process pool and
+report the throughput. Each reader passes its own convert(src, dst) -> voxels, which has to be a
+module-level function so the pool can pickle it.
+"""
+
+
+def batch_convert(paths, out_dir, convert, suffix, out_suffix, jobs=None):
+    """
+    Converts the suffix files (and every one in the given directories) to <out_dir>/<name><out_suffix>
+    with a process pool, then prints a throughput summary.
+    """
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.rglob("*" + suffix)) if path.is_dir() else [path]
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    n_bytes = sum(os.path.getsize(f) for f in files)
+    voxels, failed = 0, 0
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(convert, str(f), os.path.join(out_dir, f.stem + out_suffix)) for f in files]
+        for future, f in zip(futures, files):
+            try:
+                voxels += future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Error with {f}: {e}")
+    elapsed = time.perf_counter() - t0
+    print(f"{len(files) - failed}/{len(files)} {suffix} files in {elapsed:.2f} s: "
+          f"{(len(files) - failed) / elapsed:.1f} files/s, {voxels / elapsed / 1e6:.1f} M voxels/s, "
+          f"{n_bytes / elapsed / 1e6:.1f} MB/s read")
+
+
+def main(description, convert, suffix, out_suffix, show):
+    """command line of a reader: -o converts the paths with batch_convert(), otherwise show(filename) prints each"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("paths", nargs="+", help=f"{suffix} files or directories of them")
+    parser.add_argument("-o", "--out", help=f"convert to {out_suffix} files in this directory instead of printing")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    if args.out:
+        batch_convert(args.paths, args.out, convert, suffix, out_suffix, args.jobs)
+        return
+    for filename in args.paths:
+        show(filename)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from nbt import nbt
+
+from schematic_to_block import load_schem
+
+"""
+Times load_schem's vectorized varint decoding against a per-byte Python loop on a large synthetic
+Sponge v2 .schem, and checks that both decode the same blocks.
+
+python bench_schem.py --size 256 --palette 300
+"""
+
+
+def encode_varints(values):
+    out = bytearray()
+    for value in values.tolist():
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+    return out
+
+
+def make_schem(path, size, palette_size, seed=0):
+    """Writes a size^3 Sponge v2 schem with random blocks; returns the (y, z, x) index array."""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, palette_size, size=(size, size, size))
+
+    schem = nbt.NBTFile()
+    schem.name = "Schematic"
+    schem.tags.append(nbt.TAG_Int(name="Version", value=2))
+    for name in ("Width", "Height", "Length"):
+        schem.tags.append(nbt.TAG_Short(name=name, value=size))
+    palette = nbt.TAG_Compound(name="Palette")
+    for i in range(palette_size):
+        palette.tags.append(nbt.TAG_Int(name=f"minecraft:block_{i}", value=i))
+    schem.tags.append(palette)
+    schem.tags.append(nbt.TAG_Int(name="PaletteMax", value=palette_size))
+    data = nbt.TAG_Byte_Array(name="BlockData")
+    data.value = encode_varints(blocks.ravel())
+    schem.tags.append(data)
+    schem.write_file(path)
+    return blocks
+
+
+def load_schem_loop(path):
+    """The straightforward decoder: one Python iteration per byte."""
+    schem = nbt.NBTFile(path, 'rb')
+    width, height, length = schem["Width"].value, schem["Height"].value, schem["Length"].value
+    values, value, shift = [], 0, 0
+    for byte in schem["BlockData"].value:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            values.append(value)
+            value, shift = 0, 0
+    return np.array(values).reshape((height, length, width)).transpose(2, 0, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Sponge .schem decoding")
+    parser.add_argument("--size", type=int, default=256, help="side length of the synthetic schem")
+    parser.add_argument("--palette", type=int, default=300, help="palette entries (over 127 needs 2-byte varints)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.schem")
+        blocks = make_schem(path, args.size, args.palette)
+        voxels = blocks.size
+        print(f"{args.size}^3 schem, {args.palette} palette entries, {os.path.getsize(path) / 1e6:.1f} MB on disk")
+
+        t0 = time.perf_counter()
+        arr, palette, dims = load_schem(path)
+        fast = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        reference = load_schem_loop(path)
+        slow = time.perf_counter() - t0
+
+        assert (arr == blocks.transpose(2, 0, 1)).all() and (arr == reference).all()
+        assert palette[args.palette - 1] == f"minecraft:block_{args.palette - 1}"
+        print(f"{'per-byte loop':<16}{slow:>8.2f} s {voxels / slow / 1e6:>8.1f} M voxels/s")
+        print(f"{'load_schem':<16}{fast:>8.2f} s {voxels / fast / 1e6:>8.1f} M voxels/s ({slow / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import atexit
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+'''
+stage-level instrumentation: named spans and counters, off unless enabled
+
+    import instrument
+    with instrument.span('sendit.upload', blocks=len(ids)):
+        ...
+    instrument.count('bytes', len(body))
+
+disabled (the default), span() hands back one shared no-op context manager and count() returns
+straight away, so instrumented code costs a global lookup and a call per span.
+enable it with instrument.enable(), or for a whole run with the INSTRUMENT environment variable:
+
+    INSTRUMENT=trace.json python minecraft.py
+
+which prints summary() at exit and writes a Chrome trace (open it in chrome://tracing or ui.perfetto.dev).
+work done in other processes is lost unless the worker returns drain() and the parent merge()s it.
+scripts outside utils/ add it to sys.path before importing it.
+'''
+
+ENV = "INSTRUMENT"
+
+enabled = False
+_lock = threading.Lock()
+_events = []  # (name, start ns, duration ns, pid, tid, args); duration None for counter samples
+_counters = Counter()
+_NOOP = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _events.append((self.name, self.start, end - self.start, os.getpid(), threading.get_ident(), self.args))
+        return False
+
+
+def span(name, **args):
+    '''
+    times the with-block as one occurrence of stage name; args are kept with it in the trace
+    '''
+    if not enabled:
+        return _NOOP
+    return _Span(name, args)
+
+
+def traced(name=None):
+    '''decorator: every call of the function is a span, named after the function by default'''
+    def wrap(fn):
+        label = name or fn.__module__ + '.' + fn.__qualname__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Span(label, {}):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def count(name, n=1):
+    '''adds n to counter name, e.g. count('bytes', len(body)) or count('requests')'''
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] += n
+        _events.append((name, time.perf_counter_ns(), None, os.getpid(), threading.get_ident(), _counters[name]))
+
+
+def enable(trace_path=None):
+    '''
+    starts recording; with trace_path, summary() is printed and the trace written there when the process exits
+    '''
+    global enabled
+    enabled = True
+    if trace_path:
+        def finish():
+            # worker processes inherit the setting (and the hook, when forked); only the main process reports
+            if multiprocessing.parent_process() is None and _events:
+                summary()
+                write_chrome_trace(trace_path)
+        atexit.register(finish)
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    '''forgets every recorded span and counter'''
+    with _lock:
+        _events.clear()
+        _counters.clear()
+
+
+def drain():
+    '''(events, counters) recorded so far, cleared here; return them from a worker process and merge() them'''
+    with _lock:
+        events, counters = list(_events), dict(_counters)
+        _events.clear()
+        _counters.clear()
+    return events, counters
+
+
+def merge(drained):
+    '''adds the output of drain() from another process'''
+    events, counters = drained
+    with _lock:
+        _events.extend(events)
+        _counters.update(counters)
+
+
+def stages():
+    '''{span name: [durations in seconds]} of everything recorded'''
+    out = defaultdict(list)
+    for name, _, duration, _, _, _ in list(_events):
+        if duration is not None:
+            out[name].append(duration / 1e9)
+    return out
+
+
+def counters():
+    return dict(_counters)
+
+
+def summary(file=None):
+    '''
+    prints one row per stage (calls, total, mean and max time, share of the traced wall time, which
+    passes 100% when threads or processes overlap), then the counters with their rate over that wall time
+    '''
+    events = list(_events)
+    if not events:
+        print("instrument: nothing recorded", file=file)
+        return
+    first = min(start for _, start, _, _, _, _ in events)
+    last = max(start + (duration or 0) for _, start, duration, _, _, _ in events)
+    wall = max(last - first, 1) / 1e9
+
+    print(f"{'stage':<32}{'calls':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}{'% wall':>8}", file=file)
+    for name, durations in sorted(stages().items(), key=lambda item: -sum(item[1])):
+        total = sum(durations)
+        print(f"{name:<32}{len(durations):>8}{total:>10.3f}{total / len(durations) * 1000:>10.2f}"
+              f"{max(durations) * 1000:>10.2f}{total / wall * 100:>7.1f}%", file=file)
+    if _counters:
+        print(f"{'counter':<32}{'total':>18}{'per s':>18}", file=file)
+        for name, value in sorted(_counters.items()):
+            print(f"{name:<32}{value:>18,}{value / wall:>18,.1f}", file=file)
+    print(f"{'wall':<32}{wall:>18.3f} s", file=file)
+
+
+def chrome_trace():
+    '''the recorded events in the Chrome trace event format, as a dict'''
+    trace = []
+    for name, start, duration, pid, tid, args in list(_events):
+        if duration is None:
+            trace.append({'name': name, 'ph': 'C', 'ts': start / 1e3, 'pid': pid, 'tid': tid, 'args': {name: args}})
+        else:
+            trace.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': start / 1e3,
+                          'dur': duration / 1e3, 'pid': pid, 'tid': tid, 'args': args})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path):
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(), f, default=str)
+    print(f"instrument: wrote {len(_events)} events to {path}")
+
+
+if os.environ.get(ENV):
+    enable(os.environ[ENV])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+from math import gcd
+
+import numpy as np
+import nbtlib
+
+import batch_convert as batch
+
+"""
+Reads .litematic regions straight into NumPy, without going through litemapy's region[x, y, z].
+
+BlockStates is a long array of palette indices packed at max(2, bits for len(palette) - 1) bits
+each, in y, z, x order, with entries allowed to straddle two longs. nbtlib already gives the long
+array as an ndarray, so the unpacking below is a handful of whole-array shifts.
+
+python litematic_to_block.py litematic_files/ -o arrays/ -j 8
+"""
+
+
+def needed_bits(palette_size):
+    return max(2, (palette_size - 1).bit_length())
+
+
+def unpack_longs(longs, size, nbits):
+    """
+    size palette indices of nbits bits each from a Litematica long array. Entry positions repeat
+    every lcm(nbits, 64) bits, so the longs are reshaped into such periods and each of the
+    64 / gcd(nbits, 64) entry slots of a period is extracted with one shift over all periods.
+    """
+    # nbtlib keeps the big-endian file bytes, so convert to native before reinterpreting as unsigned
+    words = np.asarray(longs, dtype=np.int64).view(np.uint64)
+    expected = -(-size * nbits // 64)
+    if words.size != expected:
+        raise ValueError(f"BlockStates holds {words.size} longs, expected {expected}")
+    slots, period = 64 // gcd(nbits, 64), nbits // gcd(nbits, 64)
+    words = np.concatenate((words, np.zeros(-words.size % period, dtype=np.uint64))).reshape(-1, period)
+
+    mask = np.uint64((1 << nbits) - 1)
+    out = np.empty((words.shape[0], slots), dtype=np.uint64)
+    for slot in range(slots):
+        word, shift = divmod(slot * nbits, 64)
+        entry = words[:, word] >> np.uint64(shift)
+        if shift + nbits > 64:
+            entry |= words[:, word + 1] << np.uint64(64 - shift)
+        out[:, slot] = entry & mask
+    return out.ravel()[:size]
+
+
+def state_name(block):
+    """Sponge-style block state: minecraft:oak_stairs[facing=east,half=bottom]"""
+    name = str(block["Name"])
+    properties = block.get("Properties")
+    if properties:
+        name += "[" + ",".join(f"{k}={properties[k]}" for k in sorted(properties)) + "]"
+    return name
+
+
+def load_litematic(filename):
+    """
+    Every region of a .litematic as {name: (arr, palette, position)}: arr is the (x, y, z) uint16
+    index array in litemapy's storage order, palette the block states by index and position the
+    region's minimum corner in schematic coordinates.
+    """
+    regions = {}
+    for name, region in nbtlib.load(filename)["Regions"].items():
+        pos, size = region["Position"], region["Size"]
+        dims = [int(size[axis]) for axis in "xyz"]
+        # negative sizes extend the region back from Position
+        position = tuple(int(pos[axis]) + min(0, d + 1) for axis, d in zip("xyz", dims))
+        width, height, length = map(abs, dims)
+
+        palette = [state_name(block) for block in region["BlockStatePalette"]]
+        if len(palette) > 1 << 16:
+            raise ValueError(f"region {name} has {len(palette)} block states, more than uint16 holds")
+        volume = width * height * length
+        indices = unpack_longs(region["BlockStates"], volume, needed_bits(len(palette)))
+        arr = indices.astype(np.uint16).reshape((height, length, width)).transpose(2, 0, 1)
+        regions[name] = (arr, palette, position)
+    return regions
+
+
+def convert(src, dst):
+    """writes every region of src to dst .npz as blocks_<i>, palette_<i>, position_<i> plus the region names"""
+    regions = load_litematic(src)
+    arrays = {"regions": np.array(list(regions))}
+    voxels = 0
+    for i, (arr, palette, position) in enumerate(regions.values()):
+        arrays[f"blocks_{i}"], arrays[f"palette_{i}"], arrays[f"position_{i}"] = arr, np.array(palette), position
+        voxels += arr.size
+    np.savez(dst, **arrays)
+    return voxels
+
+
+def batch_convert(paths, out_dir, jobs=None):
+    """
+    Converts .litematic files (and every .litematic in the given directories) to <out_dir>/<name>.npz,
+    see batch_convert.batch_convert().
+    """
+    batch.batch_convert(paths, out_dir, convert, ".litematic", ".npz", jobs)
+
+
+def show(filename):
+    for name, (arr, palette, position) in load_litematic(filename).items():
+        print(f"{name}: {arr.shape} at {position}, {len(palette)} block states")
+
+
+def main():
+    batch.main("Decode .litematic regions to arrays", convert, ".litematic", ".npz", show)
+
+
+if __name__ == "__main__":
+    main()
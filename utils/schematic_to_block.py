@@ -1,30 +1,168 @@
-#!/usr/bin/env python3
-import sys
-import numpy as np
-from nbt import nbt
-
-
-def load_schematic(filename):
-    schematic = nbt.NBTFile(filename, 'rb')
-    width = schematic["Width"].value
-    height = schematic["Height"].value
-    length = schematic["Length"].value
-    blocks = schematic["Blocks"].value
-    arr = np.array(blocks).reshape((height, length, width))
-    arr = np.transpose(arr, (2, 0, 1))
-    return arr, (width, height, length)
-
-
-def convert_ids_to_names(block_array):
-    vectorized_map = np.vectorize(lambda bid: BLOCK_ID_TO_NAME.get(bid, f"ID_{bid}"))
-    return vectorized_map(block_array)
-
-
-def main():
-    filename = sys.argv[1]
-    arr, dims = load_schematic(filename)
-    print(arr)
-
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+import numpy as np
+from nbt import nbt
+
+import batch_convert as batch
+
+# Pre-1.13 numeric block ids (MCEdit .schematic "Blocks"), ignoring the "Data" variant
+LEGACY_NAMES = [
+    "air", "stone", "grass", "dirt", "cobblestone", "planks", "sapling", "bedrock",
+    "flowing_water", "water", "flowing_lava", "lava", "sand", "gravel", "gold_ore", "iron_ore",
+    "coal_ore", "log", "leaves", "sponge", "glass", "lapis_ore", "lapis_block", "dispenser",
+    "sandstone", "noteblock", "bed", "golden_rail", "detector_rail", "sticky_piston", "web", "tallgrass",
+    "deadbush", "piston", "piston_head", "wool", "piston_extension", "yellow_flower", "red_flower", "brown_mushroom",
+    "red_mushroom", "gold_block", "iron_block", "double_stone_slab", "stone_slab", "brick_block", "tnt", "bookshelf",
+    "mossy_cobblestone", "obsidian", "torch", "fire", "mob_spawner", "oak_stairs", "chest", "redstone_wire",
+    "diamond_ore", "diamond_block", "crafting_table", "wheat", "farmland", "furnace", "lit_furnace", "standing_sign",
+    "wooden_door", "ladder", "rail", "stone_stairs", "wall_sign", "lever", "stone_pressure_plate", "iron_door",
+    "wooden_pressure_plate", "redstone_ore", "lit_redstone_ore", "unlit_redstone_torch", "redstone_torch",
+    "stone_button", "snow_layer", "ice",
+    "snow", "cactus", "clay", "reeds", "jukebox", "fence", "pumpkin", "netherrack",
+    "soul_sand", "glowstone", "portal", "lit_pumpkin", "cake", "unpowered_repeater", "powered_repeater",
+    "stained_glass",
+    "trapdoor", "monster_egg", "stonebrick", "brown_mushroom_block", "red_mushroom_block", "iron_bars", "glass_pane",
+    "melon_block",
+    "pumpkin_stem", "melon_stem", "vine", "fence_gate", "brick_stairs", "stone_brick_stairs", "mycelium", "waterlily",
+    "nether_brick", "nether_brick_fence", "nether_brick_stairs", "nether_wart", "enchanting_table", "brewing_stand",
+    "cauldron", "end_portal",
+    "end_portal_frame", "end_stone", "dragon_egg", "redstone_lamp", "lit_redstone_lamp", "double_wooden_slab",
+    "wooden_slab", "cocoa",
+    "sandstone_stairs", "emerald_ore", "ender_chest", "tripwire_hook", "tripwire", "emerald_block", "spruce_stairs",
+    "birch_stairs",
+    "jungle_stairs", "command_block", "beacon", "cobblestone_wall", "flower_pot", "carrots", "potatoes",
+    "wooden_button",
+    "skull", "anvil", "trapped_chest", "light_weighted_pressure_plate", "heavy_weighted_pressure_plate",
+    "unpowered_comparator", "powered_comparator", "daylight_detector",
+    "redstone_block", "quartz_ore", "hopper", "quartz_block", "quartz_stairs", "activator_rail", "dropper",
+    "stained_hardened_clay",
+    "stained_glass_pane", "leaves2", "log2", "acacia_stairs", "dark_oak_stairs", "slime", "barrier", "iron_trapdoor",
+    "prismarine", "sea_lantern", "hay_block", "carpet", "hardened_clay", "coal_block", "packed_ice", "double_plant",
+    "standing_banner", "wall_banner", "daylight_detector_inverted", "red_sandstone", "red_sandstone_stairs",
+    "double_stone_slab2", "stone_slab2", "spruce_fence_gate",
+    "birch_fence_gate", "jungle_fence_gate", "dark_oak_fence_gate", "acacia_fence_gate", "spruce_fence",
+    "birch_fence", "jungle_fence", "dark_oak_fence",
+    "acacia_fence", "spruce_door", "birch_door", "jungle_door", "acacia_door", "dark_oak_door", "end_rod",
+    "chorus_plant",
+    "chorus_flower", "purpur_block", "purpur_pillar", "purpur_stairs", "purpur_double_slab", "purpur_slab",
+    "end_bricks", "beetroots",
+    "grass_path", "end_gateway", "repeating_command_block", "chain_command_block", "frosted_ice", "magma",
+    "nether_wart_block", "red_nether_brick",
+    "bone_block", "structure_void", "observer",
+    *(color + "_shulker_box" for color in (
+        "white", "orange", "magenta", "light_blue", "yellow", "lime", "pink", "gray",
+        "silver", "cyan", "purple", "blue", "brown", "green", "red", "black")),
+    *(color + "_glazed_terracotta" for color in (
+        "white", "orange", "magenta", "light_blue", "yellow", "lime", "pink", "gray",
+        "silver", "cyan", "purple", "blue", "brown", "green", "red", "black")),
+    "concrete", "concrete_powder",
+]
+
+# Dense id -> name table over every id AddBlocks can express (12 bits); unknown ids keep the ID_<n> name
+BLOCK_ID_TO_NAME = np.array([f"ID_{i}" for i in range(4096)], dtype=object)
+BLOCK_ID_TO_NAME[:len(LEGACY_NAMES)] = ["minecraft:" + name for name in LEGACY_NAMES]
+BLOCK_ID_TO_NAME[255] = "minecraft:structure_block"
+
+
+def nibbles(packed, size):
+    # AddBlocks packs two 4-bit values per byte, the even index in the low nibble
+    return np.stack([packed & 0x0F, packed >> 4], axis=-1).ravel()[:size]
+
+
+def load_schematic(filename, with_data=False):
+    schematic = nbt.NBTFile(filename, 'rb')
+    width = schematic["Width"].value
+    height = schematic["Height"].value
+    length = schematic["Length"].value
+    # the NBT byte arrays are bytearrays, so frombuffer views them without copying
+    arr = np.frombuffer(schematic["Blocks"].value, dtype=np.uint8).reshape((height, length, width))
+    if "AddBlocks" in schematic:
+        add = nibbles(np.frombuffer(schematic["AddBlocks"].value, dtype=np.uint8), arr.size)
+        arr = arr | (add.astype(np.uint16) << 8).reshape(arr.shape)
+    arr = np.transpose(arr, (2, 0, 1))
+    if with_data:
+        data = np.frombuffer(schematic["Data"].value, dtype=np.uint8).reshape((height, length, width))
+        return arr, np.transpose(data, (2, 0, 1)), (width, height, length)
+    return arr, (width, height, length)
+
+
+def decode_varints(data, count=None):
+    """
+    Decodes a buffer of LEB128 varints (Sponge BlockData) without a per-byte loop: every byte
+    with a clear high bit ends a value, and byte j of every value is gathered at once, so there
+    is one pass per byte of the longest value (2 for palettes under 16384 entries).
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if raw.size == 0 or raw.max() < 0x80:  # palettes under 128 entries: one byte per value
+        values = raw.astype(np.uint32)
+    else:
+        ends = np.flatnonzero(raw < 0x80)
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        lengths = ends - starts + 1
+        longest = lengths.max()
+        # padded so byte j of the last value is in bounds; bytes past a value's end are masked off
+        padded = np.zeros(raw.size + longest, dtype=np.uint32)
+        padded[:raw.size] = raw & 0x7F
+        values = padded[starts]
+        for j in range(1, longest):
+            values |= np.where(lengths > j, padded[starts + j], 0).astype(np.uint32) << (7 * j)
+    if count is not None and values.size != count:
+        raise ValueError(f"BlockData holds {values.size} blocks, expected {count}")
+    return values
+
+
+def load_schem(filename):
+    """
+    Sponge .schem (v2, or v3 with its Blocks container), as (x, y, z) palette indices,
+    the palette (block states by index) and (width, height, length).
+    """
+    schematic = nbt.NBTFile(filename, 'rb')
+    if "Schematic" in schematic:  # v3 nests everything one level down
+        schematic = schematic["Schematic"]
+    width = schematic["Width"].value
+    height = schematic["Height"].value
+    length = schematic["Length"].value
+    if "Blocks" in schematic:
+        palette_tag, data = schematic["Blocks"]["Palette"], schematic["Blocks"]["Data"].value
+    else:
+        palette_tag, data = schematic["Palette"], schematic["BlockData"].value
+
+    palette = [None] * len(palette_tag.tags)
+    for tag in palette_tag.tags:
+        palette[tag.value] = tag.name
+    # blocks are stored y-major then z then x, like the legacy format
+    arr = decode_varints(data, width * height * length).reshape((height, length, width))
+    arr = np.transpose(arr, (2, 0, 1))
+    return arr, palette, (width, height, length)
+
+
+def convert_ids_to_names(block_array):
+    return np.take(BLOCK_ID_TO_NAME, block_array)
+
+
+def convert(src, dst):
+    arr, _ = load_schematic(src)
+    np.save(dst, arr.astype(np.uint16))
+    return arr.size
+
+
+def batch_convert(paths, out_dir, jobs=None):
+    """
+    Converts .schematic files (and every .schematic in the given directories) to <out_dir>/<name>.npy
+    (x, y, z) uint16 block ids, see batch_convert.batch_convert().
+    """
+    batch.batch_convert(paths, out_dir, convert, ".schematic", ".npy", jobs)
+
+
+def show(filename):
+    arr, dims = load_schematic(filename)
+    print(arr)
+
+
+def main():
+    batch.main("Decode .schematic block ids", convert, ".schematic", ".npy", show)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+PyTorch Dataset over the build folders auto_down.py writes (one folder per build, one PNG per layer).
+
+Each item is an (x, y, z) int64 tensor of block ids into SliceDataset.names, 0 being air; colors
+map to blocks as in voxel_corpus.slice_quantizer(). Builds are decoded in the DataLoader workers,
+so num_workers builds are decoded in parallel:
+
+    dataset = SliceDataset("dataset", persist=True)
+    loader = DataLoader(dataset, batch_size=8, num_workers=8, collate_fn=list, shuffle=True)
+
+Builds have different sizes, hence collate_fn=list. With persist=True the decoded ids are saved as
+blocks.npy in the build folder, so later epochs (and runs) memory-map that instead of decoding PNGs.
+
+python slice_dataset.py dataset/ --persist     # decode every build once and report throughput
+"""
+import argparse
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from voxel_corpus import AVGS_CSV, read_slices, slice_files, slice_quantizer
+
+PERSIST_NAME = "blocks.npy"
+
+
+class SliceDataset(Dataset):
+    def __init__(self, root, csv_path=AVGS_CSV, cache_size=32, persist=False, transform=None):
+        """
+        root: auto_down.py output directory (or a list of build folders)
+        cache_size: decoded builds kept in memory, per worker process
+        persist: save decoded ids as blocks.npy next to the slices and reuse them while they are newer than the PNGs
+        transform: applied to each (x, y, z) tensor
+        """
+        if isinstance(root, (str, Path)):
+            self.build_dirs = sorted(p for p in Path(root).iterdir() if p.is_dir() and any(p.glob("*.png")))
+        else:
+            self.build_dirs = [Path(p) for p in root]
+        # the same mapping as voxel_corpus.slice_dir_volume
+        self.quantizer = slice_quantizer(csv_path)
+        self.names = self.quantizer.palette
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.persist = persist
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.build_dirs)
+
+    def decode(self, build_dir):
+        """(x, y, z) int16 block ids of a build folder, from blocks.npy when it is up to date"""
+        saved = build_dir / PERSIST_NAME
+        if saved.exists():
+            newest = max(os.path.getmtime(f) for f in slice_files(build_dir))
+            if os.path.getmtime(saved) >= newest:
+                return np.load(saved, mmap_mode="r")
+
+        ids = self.quantizer(read_slices(build_dir)).astype(np.int16)
+        if self.persist:
+            # write then rename, so a worker killed mid-save never leaves a truncated blocks.npy
+            tmp = build_dir / (PERSIST_NAME + ".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, ids)
+            os.replace(tmp, saved)
+        return ids
+
+    def __getitem__(self, i):
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            ids = self.cache[i]
+        else:
+            ids = self.decode(self.build_dirs[i])
+            if self.cache_size:
+                self.cache[i] = ids
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+        volume = torch.from_numpy(np.array(ids, dtype=np.int64))
+        if self.transform is not None:
+            volume = self.transform(volume)
+        return volume
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode auto_down.py build folders to block ids")
+    parser.add_argument("root", help="auto_down.py output directory")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--persist", action="store_true", help="save blocks.npy next to the slices")
+    parser.add_argument("--epochs", type=int, default=1, help="passes over the dataset")
+    args = parser.parse_args()
+
+    dataset = SliceDataset(args.root, persist=args.persist)
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=1, num_workers=args.workers, collate_fn=list, persistent_workers=args.workers > 0
+    )
+    for epoch in range(args.epochs):
+        t0 = time.perf_counter()
+        voxels = sum(volume.numel() for batch in loader for volume in batch)
+        elapsed = time.perf_counter() - t0
+        print(f"epoch {epoch}: {len(dataset)} builds, {voxels / elapsed / 1e6:.1f} M voxels/s, {elapsed:.2f} s")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Sharded, memory-mappable voxel corpus.
+
+A corpus directory holds
+    palette.json       block names shared by every build, index 0 is minecraft:air
+    index.json         one entry per build: name, source, shard, offset and dims (x, y, z)
+    shard_00000.npy    uint16 palette indices of many builds, each flattened in C order
+
+Builds never straddle shards, so a build is np.load(shard, mmap_mode='r')[offset:offset + x*y*z].
+
+python voxel_corpus.py corpus/ builds/*.litematic schematics/*.schem* render_objects/*.json
+python voxel_corpus.py corpus/ --slices dataset/      # convert auto_down.py PNG slice folders
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+sys.path.append(str(Path(__file__).resolve().parent.parent / "mcvis"))  # quantize.py
+from quantize import AIR, AVGS_CSV, Quantizer, full_block
+sys.path.append(str(Path(__file__).resolve().parent.parent / "scraper/grabcraft-to-schema"))  # block_index.py
+from block_index import render_object_voxels
+
+# the readers next to this file need nbtlib (.litematic) and nbt (.schematic, .schem); without them
+# those formats fail when read, the others still convert
+try:
+    import litematic_to_block
+except ImportError as e:
+    litematic_to_block, litematic_error = None, e
+try:
+    import schematic_to_block
+except ImportError as e:
+    schematic_to_block, schematic_error = None, e
+
+PALETTE = "palette.json"
+INDEX = "index.json"
+SHARD = "shard_{:05d}.npy"
+# voxels per shard, 128 MB of uint16
+SHARD_SIZE = 1 << 26
+# what auto_down.py renders grabcraft blocks as, so the only colors its PNG slices hold
+RENDER_BLOCKMAP = Path(__file__).parent.parent / "scraper/grabcraft-to-schema/data/blockmap.csv"
+# blocks that share a common block's texture, and so its average color, but are rarely what a build holds
+LOOKALIKES = ("infested_", "petrified_", "potted_", "end_portal")
+
+
+class CorpusWriter:
+    def __init__(self, corpus_dir, shard_size=SHARD_SIZE):
+        """Writes builds into corpus_dir, appending to the corpus already there if any."""
+        self.corpus_dir = Path(corpus_dir)
+        self.corpus_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.palette = [AIR]
+        self.index = []
+        if (self.corpus_dir / PALETTE).exists():
+            self.palette = json.loads((self.corpus_dir / PALETTE).read_text())
+            self.index = json.loads((self.corpus_dir / INDEX).read_text())
+        self.palette_ids = {name: i for i, name in enumerate(self.palette)}
+        self.shard = 1 + max((entry["shard"] for entry in self.index), default=-1)
+        self.pending = []
+        self.pending_size = 0
+
+    def add(self, name, volume, palette, source=""):
+        """
+        volume: (x, y, z) int array of indices into palette
+        palette: block names of this build
+        """
+        lookup = np.array([self.palette_id(block) for block in palette], dtype=np.uint16)
+        flat = lookup[np.asarray(volume).ravel()]
+        if self.pending and self.pending_size + flat.size > self.shard_size:
+            self.flush()
+        self.index.append({
+            "name": name,
+            "source": source,
+            "shard": self.shard,
+            "offset": self.pending_size,
+            "dims": [int(d) for d in np.shape(volume)],
+        })
+        self.pending.append(flat)
+        self.pending_size += flat.size
+
+    def palette_id(self, block):
+        if block not in self.palette_ids:
+            if len(self.palette) > np.iinfo(np.uint16).max:
+                raise ValueError("corpus palette is full (65536 blocks)")
+            self.palette_ids[block] = len(self.palette)
+            self.palette.append(block)
+        return self.palette_ids[block]
+
+    def flush(self):
+        """Writes the pending builds as the next shard."""
+        if not self.pending:
+            return
+        np.save(self.corpus_dir / SHARD.format(self.shard), np.concatenate(self.pending))
+        self.shard += 1
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        """Writes the last shard, then the palette and index (atomically, so readers never see a partial index)."""
+        self.flush()
+        for file_name, data in ((PALETTE, self.palette), (INDEX, self.index)):
+            tmp = self.corpus_dir / (file_name + ".tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.corpus_dir / file_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Corpus:
+    def __init__(self, corpus_dir):
+        """Read-only view of a corpus; volumes are memory-mapped, not loaded."""
+        self.corpus_dir = Path(corpus_dir)
+        self.palette = json.loads((self.corpus_dir / PALETTE).read_text())
+        self.index = json.loads((self.corpus_dir / INDEX).read_text())
+        self.shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """(x, y, z) uint16 memmap of palette indices for build i"""
+        entry = self.index[i]
+        shard = entry["shard"]
+        if shard not in self.shards:
+            self.shards[shard] = np.load(self.corpus_dir / SHARD.format(shard), mmap_mode="r")
+        size = int(np.prod(entry["dims"]))
+        return self.shards[shard][entry["offset"]:entry["offset"] + size].reshape(entry["dims"])
+
+    def names(self, volume):
+        """block names for a volume from this corpus"""
+        return np.array(self.palette, dtype=object)[volume]
+
+
+## SOURCES ##
+# each returns (volume, palette): an (x, y, z) int array of indices into a list of block names
+
+def render_object_volume(render_object, dims=None):
+    """
+    GrabCraft RenderObject (or its .obj: the JSON dict / string keyed obj[y][x][z], 1-based).
+    Voxels missing from the object are air.
+    """
+    xyz, names, dims = render_object_voxels(render_object, dims)
+    palette, ids = np.unique(names, return_inverse=True)
+    volume = np.zeros(dims, dtype=np.uint16)
+    volume[tuple(xyz)] = ids.ravel() + 1
+    return volume, [AIR] + palette.tolist()
+
+def litematic_volumes(path):
+    """one (region name, volume, palette) per region of a .litematic, palette as full block states"""
+    if litematic_to_block is None:
+        raise litematic_error
+    for region_name, (arr, palette, _) in litematic_to_block.load_litematic(str(path)).items():
+        yield region_name, arr, palette
+
+def schematic_volume(path):
+    """legacy MCEdit .schematic, named by schematic_to_block.BLOCK_ID_TO_NAME"""
+    if schematic_to_block is None:
+        raise schematic_error
+    arr, _ = schematic_to_block.load_schematic(str(path))
+    ids, volume = np.unique(arr, return_inverse=True)
+    return volume.reshape(arr.shape), schematic_to_block.convert_ids_to_names(ids).tolist()
+
+def schem_volume(path):
+    """Sponge .schem (v2/v3), e.g. the abfielder downloads without a litematic"""
+    if schematic_to_block is None:
+        raise schematic_error
+    arr, palette, _ = schematic_to_block.load_schem(str(path))
+    return arr, palette
+
+def slice_files(slice_dir):
+    """the layer PNGs of a build folder written by auto_down.py (<name>_<z>.png), in z order"""
+    return sorted(Path(slice_dir).glob("*.png"), key=lambda p: int(p.stem.rsplit("_", 1)[-1]))
+
+def read_slices(slice_dir):
+    """(x, y, z, 4) uint8 RGBA of a build folder; image column is x and image row is y"""
+    from PIL import Image
+    # (z, y, x, 4) -> (x, y, z, 4)
+    return np.stack([np.asarray(Image.open(f).convert("RGBA")) for f in slice_files(slice_dir)]).transpose(2, 1, 0, 3)
+
+def render_targets(blockmap=RENDER_BLOCKMAP):
+    """the block names auto_down.py renders: the targets of blockmap.csv, without block states"""
+    with open(blockmap, newline="") as f:
+        return {row["to"].split("[")[0] for row in csv.DictReader(f) if row["to"]}
+
+def plain_block(name):
+    """full cubes other than the look-alikes of a common block (infested_stone looks like stone)"""
+    return full_block(name) and not any(part in name for part in LOOKALIKES)
+
+def slice_quantizer(csv_path=AVGS_CSV, blockmap=RENDER_BLOCKMAP):
+    """
+    the color -> block mapping for auto_down.py slices: the nearest RGBA among the blocks the renderer
+    produces, plain full blocks first where several share an average color (oak_planks, not oak_stairs)
+    """
+    return Quantizer(csv_path, exact=True, alpha=True, allow=render_targets(blockmap), prefer=plain_block)
+
+def slice_dir_volume(slice_dir, quantizer=None):
+    """
+    a build folder written by auto_down.py. Transparent pixels are air, every other color is a block
+    from slice_quantizer() (or the given quantizer).
+    """
+    quantizer = slice_quantizer() if quantizer is None else quantizer
+    ids = quantizer(read_slices(slice_dir))
+    used, volume = np.unique(ids, return_inverse=True)
+    return volume.reshape(ids.shape), [quantizer.palette[i] for i in used]
+
+
+def add_path(writer, path, quantizer=None):
+    """
+    adds whatever is at path: a .litematic, .schematic, .schem, render object .json or PNG slice folder
+    quantizer: for slice folders, see slice_dir_volume(); pass one when adding many, it is built once
+    """
+    path = Path(path)
+    if path.is_dir():
+        writer.add(path.name, *slice_dir_volume(path, quantizer), source=str(path))
+    elif path.suffix == ".litematic":
+        for region_name, volume, palette in litematic_volumes(path):
+            writer.add(f"{path.stem}:{region_name}", volume, palette, source=str(path))
+    elif path.suffix == ".schematic":
+        writer.add(path.stem, *schematic_volume(path), source=str(path))
+    elif path.suffix == ".schem":
+        writer.add(path.stem, *schem_volume(path), source=str(path))
+    elif path.suffix == ".json":
+        writer.add(path.stem, *render_object_volume(json.loads(path.read_text())), source=str(path))
+    else:
+        raise ValueError(f"don't know how to read {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert builds to a sharded voxel corpus")
+    parser.add_argument("corpus", help="corpus directory, appended to if it exists")
+    parser.add_argument("paths", nargs="*", help=".litematic, .schematic, .schem, render object .json or slice folders")
+    parser.add_argument("--slices", help="auto_down.py output directory: every build folder in it is converted")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="voxels per shard")
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    if args.slices:
+        paths += sorted(p for p in Path(args.slices).iterdir() if p.is_dir())
+    # one color -> block mapping for every slice folder, rather than re-reading the CSVs per build
+    quantizer = slice_quantizer() if any(Path(p).is_dir() for p in paths) else None
+    with CorpusWriter(args.corpus, args.shard_size) as writer:
+        for path in paths:
+            try:
+                add_path(writer, path, quantizer)
+            except Exception as e:
+                print(f"Error with {path}: {e}")
+    print(f"{len(writer.index)} builds, {len(writer.palette)} blocks, {writer.shard} shards in {args.corpus}")
+
+
+if __name__ == "__main__":
+    main()